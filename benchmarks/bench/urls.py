@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.urls import path
+from static_models.views import StaticView
+from benchmarks.bench import views
+
+
+urlpatterns = [
+    path('light/<slug:slug>/', views.LightPageView.as_view()),
+    path('medium/<slug:slug>/', views.MediumPageView.as_view()),
+    path('heavy/<slug:slug>/', views.HeavyPageView.as_view()),
+    path('list/', views.PageListView.as_view()),
+    path('', views.HomeView.as_view()),
+    path('static/<path:path>', StaticView.as_view(path_root=str(settings.STATICVIEWS_DIR) + '/')),
+]
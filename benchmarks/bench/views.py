@@ -0,0 +1,52 @@
+from django.views.generic import DetailView, ListView, TemplateView
+from benchmarks.bench.models import Page
+
+
+# Templates by weight. Light prints a few fields, medium adds filters
+# and the related objects, heavy extends a base, includes, and loops.
+WEIGHTS = ('light', 'medium', 'heavy')
+
+
+
+class LightPageView(DetailView):
+    model = Page
+    template_name = 'bench/light.html'
+
+
+
+class MediumPageView(DetailView):
+    model = Page
+    template_name = 'bench/medium.html'
+
+
+
+class HeavyPageView(DetailView):
+    model = Page
+    template_name = 'bench/heavy.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['paragraphs'] = self.object.body.split('\n\n')
+        ctx['rows'] = range(50)
+        return ctx
+
+
+
+class PageListView(ListView):
+    model = Page
+    template_name = 'bench/list.html'
+    paginate_by = 50
+    ordering = ['pk']
+
+
+
+class HomeView(TemplateView):
+    template_name = 'bench/home.html'
+
+
+
+VIEWS = {
+    'light': LightPageView,
+    'medium': MediumPageView,
+    'heavy': HeavyPageView,
+}
@@ -0,0 +1,339 @@
+'''
+Benchmarks for the generator and StaticView.
+
+    python -m benchmarks.run --rows 2000 --weight light --weight heavy
+
+Run from the repository root. Makes a scratch database and output
+directory, fills the database with synthetic pages, then times each
+benchmark. Results are printed as JSON, or written to '--output', so
+runs can be compared.
+
+Generator benchmarks report pages per second, and peak memory. Peak
+memory is from tracemalloc, in a second run, as tracing slows the
+code. StaticView benchmarks report latency percentiles and requests
+per second. Requests are made in-process, so the numbers are for the
+view and Django, not a network or server.
+'''
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tracemalloc
+from datetime import timedelta
+
+
+WORDS = (
+    'static pages model view render template django file path query '
+    'object site build cache server request response header content '
+    'archive index manifest release worker queue thread process disk'
+).split()
+
+
+def percentile(values, pct):
+    # Nearest rank
+    values = sorted(values)
+    if (not(values)):
+        return None
+    k = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[k]
+
+def make_body(rnd, paragraphs=6, words=80):
+    return '\n\n'.join(
+        ' '.join(rnd.choice(WORDS) for _ in range(words)).capitalize() + '.'
+        for _ in range(paragraphs)
+    )
+
+def populate(rows, seed=0):
+    '''
+    Fill the database with synthetic pages.
+    '''
+    from django.utils import timezone
+    from benchmarks.bench.models import Category, Tag, Page
+
+    rnd = random.Random(seed)
+    categories = Category.objects.bulk_create(
+        Category(name=f'category {i}') for i in range(20)
+    )
+    tags = Tag.objects.bulk_create(Tag(name=f'tag {i}') for i in range(50))
+    now = timezone.now()
+    Page.objects.bulk_create(
+        (
+            Page(
+                title=' '.join(rnd.choice(WORDS) for _ in range(6)),
+                slug=f'page-{i}',
+                body=make_body(rnd),
+                category=rnd.choice(categories),
+                created=now - timedelta(days=rnd.randrange(3650)),
+            )
+            for i in range(rows)
+        ),
+        batch_size=1000,
+    )
+    Through = Page.tags.through
+    Through.objects.bulk_create(
+        (
+            Through(page_id=pk, tag_id=tag.pk)
+            for pk in Page.objects.values_list('pk', flat=True)
+            for tag in rnd.sample(tags, 5)
+        ),
+        batch_size=5000,
+    )
+
+
+
+class Bench():
+    '''
+    Run benchmarks, and collect results.
+    options
+        Parsed command line options.
+    '''
+    def __init__(self, options):
+        self.options = options
+        self.results = []
+
+    def measure(self, fn):
+        '''
+        Call fn, twice if measuring memory.
+        return
+            (return of fn, seconds, peak bytes or None)
+        '''
+        gc.collect()
+        start = time.perf_counter()
+        r = fn()
+        seconds = time.perf_counter() - start
+        peak = None
+        if (self.options.memory):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                fn()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return (r, seconds, peak)
+
+    def add(self, name, pages, seconds, peak, **data):
+        result = {
+            'name': name,
+            **data,
+            'pages': pages,
+            'seconds': round(seconds, 4),
+            'pages_per_second': round(pages / seconds, 1) if (seconds) else None,
+            'peak_memory_bytes': peak,
+        }
+        self.results.append(result)
+        if (self.options.verbose):
+            print(json.dumps(result), file=sys.stderr)
+
+    def manager(self, **kwargs):
+        from static_models.view_generator import ViewStaticManager
+        kwargs.setdefault('overwrite', True)
+        kwargs.setdefault('workers', self.options.jobs)
+        kwargs.setdefault('write_threads', self.options.write_threads)
+        kwargs.setdefault('compress', self.options.compress)
+        return ViewStaticManager(**kwargs)
+
+    def bench_query_set(self):
+        from benchmarks.bench.views import VIEWS
+        for weight in self.options.weight:
+            g = self.manager(
+                view=VIEWS[weight],
+                query='all',
+                filepath=weight,
+                filename_from_attribute='slug',
+                select_related=['category'],
+                prefetch_related=['tags'],
+            )
+            def run():
+                return g.create()
+            pages, seconds, peak = self.measure(run)
+            self.add('render_query_set', pages, seconds, peak, weight=weight, jobs=self.options.jobs)
+
+    def bench_urls(self):
+        from benchmarks.bench.models import Page
+        slugs = list(Page.objects.order_by('pk').values_list('slug', flat=True)[:self.options.urls])
+        lists = -(-Page.objects.count() // 50)
+        for weight in self.options.weight:
+            urls = {f'/{weight}/{slug}/': slug for slug in slugs}
+            if (weight == 'light'):
+                # List pages too
+                urls.update({f'/list/?page={n}': f'list-{n}' for n in range(1, lists + 1)})
+            for async_urls in ((False, True) if (self.options.use_async) else (False,)):
+                g = self.manager(
+                    urls=urls,
+                    filepath=f'urls-{weight}',
+                    async_urls=async_urls,
+                    concurrency=self.options.concurrency,
+                )
+                pages, seconds, peak = self.measure(g.create)
+                self.add(
+                    'render_urls', pages, seconds, peak,
+                    weight=weight, jobs=self.options.jobs, async_urls=async_urls
+                )
+
+    def bench_no_input(self):
+        from benchmarks.bench.views import HomeView
+        g = self.manager(view=HomeView, filename='index', workers=1)
+        repeat = self.options.repeat
+        def run():
+            count = 0
+            for _ in range(repeat):
+                count += g.render_no_input(g.View, g.filename)
+            g.save()
+            return count
+        pages, seconds, peak = self.measure(run)
+        self.add('render_no_input', pages, seconds, peak)
+
+    def bench_static_view(self):
+        from django.conf import settings
+        from static_models.client import RenderClient
+        from static_models.views import StaticView
+        from static_models.cache import FileCache
+        from benchmarks.bench.models import Page
+        from benchmarks.bench.views import VIEWS
+
+        weight = self.options.weight[0]
+        if (not((settings.STATICVIEWS_DIR / weight).is_dir())):
+            # Needs pages to serve
+            self.manager(
+                view=VIEWS[weight],
+                query='all',
+                filepath=weight,
+                filename_from_attribute='slug',
+                select_related=['category'],
+                prefetch_related=['tags'],
+            ).create()
+        slugs = list(Page.objects.values_list('slug', flat=True))
+        rnd = random.Random(1)
+        paths = [f'{weight}/{rnd.choice(slugs)}' for _ in range(self.options.requests)]
+        client = RenderClient([])
+        root = str(settings.STATICVIEWS_DIR) + '/'
+        variants = [
+            ('plain', {}, StaticView.as_view(path_root=root)),
+            ('cached', {}, StaticView.as_view(path_root=root, cache=FileCache())),
+        ]
+        if (self.options.compress):
+            # Sidecars were written, so negotiate them
+            variants.append(('compressed', {'HTTP_ACCEPT_ENCODING': 'gzip, br'}, StaticView.as_view(path_root=root)))
+        for variant, headers, view in variants:
+            latencies = []
+            start = time.perf_counter()
+            for path in paths:
+                request = client.request('/static/' + path)
+                request.META.update(headers)
+                t = time.perf_counter()
+                response = view(request, path=path)
+                if (response.streaming):
+                    b''.join(response.streaming_content)
+                response.close()
+                latencies.append(time.perf_counter() - t)
+            seconds = time.perf_counter() - start
+            self.results.append({
+                'name': 'static_view',
+                'variant': variant,
+                'requests': len(paths),
+                'seconds': round(seconds, 4),
+                'requests_per_second': round(len(paths) / seconds, 1),
+                'latency_ms': {
+                    'p50': round(percentile(latencies, 50) * 1000, 4),
+                    'p95': round(percentile(latencies, 95) * 1000, 4),
+                    'p99': round(percentile(latencies, 99) * 1000, 4),
+                    'max': round(max(latencies) * 1000, 4),
+                },
+            })
+            if (self.options.verbose):
+                print(json.dumps(self.results[-1]), file=sys.stderr)
+
+    def run(self):
+        benches = {
+            'query_set': self.bench_query_set,
+            'urls': self.bench_urls,
+            'no_input': self.bench_no_input,
+            'static_view': self.bench_static_view,
+        }
+        for name in self.options.bench or benches:
+            benches[name]()
+        return self.results
+
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark static_models')
+    parser.add_argument('--rows', type=int, default=1000, help='Synthetic pages in the database (default is 1000)')
+    parser.add_argument(
+        '--weight',
+        action='append',
+        choices=('light', 'medium', 'heavy'),
+        help="Template weights to render. Can be given more than once (default is all)"
+    )
+    parser.add_argument(
+        '--bench',
+        action='append',
+        choices=('query_set', 'urls', 'no_input', 'static_view'),
+        help="Benchmarks to run. Can be given more than once (default is all)"
+    )
+    parser.add_argument('--urls', type=int, default=200, help='Detail URLs to render, per weight (default is 200)')
+    parser.add_argument('--repeat', type=int, default=200, help='Renders of the one-off page (default is 200)')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests made to StaticView (default is 2000)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Processes to render with (default is 1)')
+    parser.add_argument('--write-threads', type=int, default=0, help='Threads to write files with (default is 0)')
+    parser.add_argument('-z', '--compress', action='append', default=[], choices=('gzip', 'br'), help='Write compressed copies')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Also render URLs with the async client')
+    parser.add_argument('--concurrency', type=int, default=10, help='With --async, URLs in progress at once (default is 10)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Do not measure peak memory (halves the time)')
+    parser.add_argument('--dir', help='Scratch directory. Kept after the run (default is a temporary directory, deleted)')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file (default is stdout)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print each result to stderr as it is made')
+    return parser
+
+def main(argv=None):
+    options = get_parser().parse_args(argv)
+    options.weight = options.weight or ['light', 'medium', 'heavy']
+    if (options.dir):
+        os.makedirs(options.dir, exist_ok=True)
+        os.environ['STATIC_MODELS_BENCH_DIR'] = options.dir
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    bench_dir = settings.BENCH_DIR
+    try:
+        settings.STATICVIEWS_DIR.mkdir(exist_ok=True)
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        from benchmarks.bench.models import Page
+        if (Page.objects.count() != options.rows):
+            Page.objects.all().delete()
+            populate(options.rows)
+
+        results = Bench(options).run()
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'options': {k: v for k, v in vars(options).items() if (k not in ('output', 'dir', 'verbose'))},
+            'results': results,
+        }
+        out = json.dumps(report, indent=2)
+        if (options.output):
+            with open(options.output, 'w', encoding='utf-8') as fd:
+                fd.write(out + '\n')
+        else:
+            print(out)
+    finally:
+        if (not(options.dir)):
+            shutil.rmtree(bench_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
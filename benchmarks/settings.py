@@ -0,0 +1,47 @@
+'''
+Settings for the benchmarks.
+A minimal project, with the app and a synthetic model. Files go in a
+scratch directory, from the environment variable 
+STATIC_MODELS_BENCH_DIR, or a new temporary directory.
+'''
+import os
+import tempfile
+from pathlib import Path
+
+
+BENCH_DIR = Path(os.environ.get('STATIC_MODELS_BENCH_DIR') or tempfile.mkdtemp(prefix='static_models_bench'))
+
+SECRET_KEY = 'benchmarks-only'
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+USE_TZ = True
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'static_models',
+    'benchmarks.bench',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BENCH_DIR / 'bench.sqlite3',
+    }
+}
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+    },
+]
+
+ROOT_URLCONF = 'benchmarks.bench.urls'
+MIDDLEWARE = []
+
+STATICVIEWS_DIR = BENCH_DIR / 'site'
+STATICVIEWS_MIDDLEWARE = []
+
+# Set by the runner, from the command line
+STATIC_VIEWS = []
@@ -5,3 +5,9 @@ from django.utils.translation import gettext_lazy as _
 class StaticModelsConfig(AppConfig):
     name = 'static_models'
     verbose_name = _("Generate static pages from models")
+
+    def ready(self):
+        from django.conf import settings
+        if (getattr(settings, 'STATICVIEWS_AUTOREGISTER', False)):
+            from static_models.signals import autoregister
+            autoregister()
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from static_models.signals import page_written
+from static_models.writer import SIDECARS, sidecar_path
+
+
+class CachedFile():
+    '''
+    Data cached about a file.
+    stat
+        os.stat_result, or None if the file did not exist.
+    body
+        File content, or None if the file is too large to cache.
+    '''
+    __slots__ = ('stat', 'body', 'checked')
+
+    def __init__(self, stat, body, checked):
+        self.stat = stat
+        self.body = body
+        self.checked = checked
+
+    @property
+    def size(self):
+        return len(self.body) if (self.body is not None) else 0
+
+
+
+class FileCache():
+    '''
+    A bounded LRU cache of file stats and small file bodies.
+    For StaticView, so popular pages are delivered without touching
+    the disk. An entry is trusted for check_interval seconds, then
+    the file is stat()ed again, and the entry reloaded if the file has
+    changed. A body is held with the stat of the file it was read
+    from, so the two always agree. Entries are also dropped when the generator, in the same
+    process, sends the page_written signal.
+    max_entries
+        Most files to hold.
+    max_bytes
+        Most bytes of file content to hold.
+    max_file_size
+        Files larger than this are stat-cached, but the content is not
+        held.
+    check_interval
+        Seconds to trust an entry before checking the file. 0 checks
+        every time, which still saves the open() and read().
+    '''
+    def __init__(self,
+        max_entries=4096,
+        max_bytes=32 * 1024 * 1024,
+        max_file_size=256 * 1024,
+        check_interval=2.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        page_written.connect(self.on_page_written)
+
+    def get(self, path):
+        '''
+        Return a CachedFile for a path.
+        Raises FileNotFoundError if the file does not exist.
+        '''
+        key = os.fspath(path)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is not None):
+                self.entries.move_to_end(key)
+        if ((entry is not None) and (now - entry.checked < self.check_interval)):
+            return self._found(entry)
+        try:
+            statobj = os.stat(key)
+        except FileNotFoundError:
+            statobj = None
+        if ((entry is not None) and self._same(entry.stat, statobj)):
+            entry.checked = now
+            return self._found(entry)
+        if ((statobj is None) or (statobj.st_size > self.max_file_size)):
+            entry = CachedFile(statobj, None, now)
+        else:
+            entry = CachedFile(*self._read(key), now)
+        self._put(key, entry)
+        return self._found(entry)
+
+    def _found(self, entry):
+        if (entry.stat is None):
+            raise FileNotFoundError()
+        return entry
+
+    def _same(self, a, b):
+        if ((a is None) or (b is None)):
+            return (a is b)
+        return ((a.st_ino, a.st_mtime_ns, a.st_size) == (b.st_ino, b.st_mtime_ns, b.st_size))
+
+    def _read(self, key):
+        # return (stat, body), both of the file opened. The file may
+        # have been replaced since it was stat()ed
+        try:
+            with open(key, 'rb') as fd:
+                statobj = os.fstat(fd.fileno())
+                if (statobj.st_size > self.max_file_size):
+                    return (statobj, None)
+                body = fd.read()
+        except FileNotFoundError:
+            return (None, None)
+        if (len(body) != statobj.st_size):
+            # Written to in place, not replaced. Take it next time
+            return (statobj, None)
+        return (statobj, body)
+
+    def _put(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if (old is not None):
+                self.bytes -= old.size
+            self.entries[key] = entry
+            self.bytes += entry.size
+            while ((len(self.entries) > self.max_entries) or (self.bytes > self.max_bytes)):
+                _, old = self.entries.popitem(last=False)
+                self.bytes -= old.size
+
+    def invalidate(self, path):
+        '''
+        Drop a path, and any compressed copies, from the cache.
+        '''
+        keys = [os.fspath(path)] + [os.fspath(sidecar_path(path, e)) for e in SIDECARS]
+        with self.lock:
+            for key in keys:
+                old = self.entries.pop(key, None)
+                if (old is not None):
+                    self.bytes -= old.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def on_page_written(self, sender, path, **kwargs):
+        self.invalidate(path)
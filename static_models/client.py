@@ -0,0 +1,229 @@
+import asyncio
+from io import BytesIO
+from urllib.parse import unquote, unquote_to_bytes, urlparse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+
+
+# Clients made in this process, keyed by class and middleware
+_clients = {}
+
+def _get(client_class):
+    middleware = getattr(settings, 'STATICVIEWS_MIDDLEWARE', None)
+    key = (client_class, None if (middleware is None) else tuple(middleware))
+    client = _clients.get(key)
+    if (client is None):
+        client = client_class(middleware)
+        _clients[key] = client
+    return client
+
+def get_client():
+    '''
+    Return a RenderClient for this process.
+    Made once, on first call. Middleware is from the setting
+    STATICVIEWS_MIDDLEWARE, if defined.
+    '''
+    return _get(RenderClient)
+
+def get_async_client():
+    '''
+    Return an AsyncRenderClient for this process.
+    As get_client().
+    '''
+    return _get(AsyncRenderClient)
+
+
+
+class MiddlewareMixin:
+    '''
+    Load a given list of middleware, in place of settings.MIDDLEWARE.
+    Pages for static files rarely need sessions, CSRF, messages etc. 
+    If the list is None, use settings.MIDDLEWARE.
+    '''
+    def __init__(self, middleware=None):
+        self.middleware = middleware
+        super().__init__()
+
+    def load_middleware(self, is_async=False):
+        if (self.middleware is None):
+            return super().load_middleware(is_async)
+        # Django reads the setting directly. Swap it for the load only
+        old = settings.MIDDLEWARE
+        settings.MIDDLEWARE = self.middleware
+        try:
+            super().load_middleware(is_async)
+        finally:
+            settings.MIDDLEWARE = old
+
+
+
+class RenderHandler(MiddlewareMixin, WSGIHandler):
+    '''
+    A handler for rendering URLs in-process.
+    Like the handler run by 'runserver'. Errors it throws are natural
+    and good as they read.
+    middleware
+        see MiddlewareMixin
+    '''
+    pass
+
+
+
+class AsyncRenderHandler(MiddlewareMixin, ASGIHandler):
+    '''
+    A handler for rendering URLs in-process, asynchronously.
+    Async views run on the event loop, sync views are run in a thread
+    by Django.
+    middleware
+        see MiddlewareMixin
+    '''
+    pass
+
+
+
+class RenderClient():
+    '''
+    Render URLs through Django, in-process.
+    Long-lived. The handler, with middleware loaded, and a template
+    request environ are made once, then reused for every URL.
+    middleware
+        see RenderHandler
+    '''
+    def __init__(self, middleware=None):
+        self.handler = RenderHandler(middleware)
+        self.errors = BytesIO()
+        self.environ = self.base_environ()
+
+    def base_environ(self):
+        '''
+        The base environment for a request.
+        '''
+        # This is a minimal valid WSGI environ dictionary, plus:
+        # - HTTP_COOKIE: for cookie support,
+        # - REMOTE_ADDR: often useful, see #8551.
+        # See https://www.python.org/dev/peps/pep-3333/#environ-variables
+        return {
+            'HTTP_COOKIE': '',
+            'PATH_INFO': '/',
+            'QUERY_STRING': '',
+            'REMOTE_ADDR': '127.0.0.1',
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            # Pretend on localhost, like the development it is
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': self.errors,
+            'wsgi.multiprocess': True,
+            'wsgi.multithread': False,
+            'wsgi.run_once': False,
+        }
+
+    def get_path(self, parsed):
+        path = parsed.path
+        # If there are parameters, add them
+        if parsed.params:
+            path += ";" + parsed.params
+        path = unquote_to_bytes(path)
+        # Replace the behavior where non-ASCII values in the WSGI environ are
+        # arbitrarily decoded with ISO-8859-1.
+        # Refs comment in `get_bytes_from_wsgi()`.
+        return path.decode('iso-8859-1')
+
+    def request(self, url):
+        '''
+        Construct a GET request for a URL.
+        '''
+        parsed = urlparse(str(url))  # url can be lazy
+        return WSGIRequest({
+            **self.environ,
+            'PATH_INFO': self.get_path(parsed),
+            # WSGI requires latin-1 encoded strings. See get_path_info().
+            'QUERY_STRING': parsed.query.encode().decode('iso-8859-1'),
+            'wsgi.input': BytesIO(),
+        })
+
+    def get(self, url):
+        '''
+        Return the response for a URL.
+        '''
+        return self.handler.get_response(self.request(url))
+
+    def get_many(self, urls):
+        '''
+        Yield the response for each of a list of URLs, in order.
+        '''
+        get_response = self.handler.get_response
+        request = self.request
+        for url in urls:
+            yield get_response(request(url))
+
+
+
+class AsyncRenderClient(RenderClient):
+    '''
+    Render URLs through Django's ASGI handler, in-process.
+    So async views, and views waiting on I/O, can render concurrently
+    in one process.
+    middleware
+        see RenderHandler
+    '''
+    def __init__(self, middleware=None):
+        self.handler = AsyncRenderHandler(middleware)
+        self.scope = self.base_scope()
+
+    def base_scope(self):
+        '''
+        The base scope for a request.
+        '''
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'root_path': '',
+            'path': '/',
+            'query_string': b'',
+            'headers': [],
+            # Pretend on localhost, like the development it is
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+
+    def request(self, url):
+        '''
+        Construct a GET request for a URL.
+        '''
+        parsed = urlparse(str(url))  # url can be lazy
+        path = parsed.path
+        if parsed.params:
+            path += ";" + parsed.params
+        scope = {
+            **self.scope,
+            # ASGI paths are decoded, not WSGI's latin-1
+            'path': unquote(path),
+            'query_string': parsed.query.encode(),
+        }
+        return ASGIRequest(scope, BytesIO())
+
+    async def get(self, url):
+        '''
+        Return the response for a URL.
+        '''
+        return await self.handler.get_response_async(self.request(url))
+
+    async def get_many(self, urls, concurrency=10):
+        '''
+        Return the responses for a list of URLs, in order.
+        concurrency
+            Most URLs in progress at once.
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+        async def get(url):
+            async with semaphore:
+                return await self.get(url)
+        return await asyncio.gather(*(get(url) for url in urls))
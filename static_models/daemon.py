@@ -0,0 +1,176 @@
+import os
+import json
+import socket
+import socketserver
+from time import perf_counter
+from fnmatch import fnmatch
+from pathlib import Path
+from django.conf import settings
+from django.db import close_old_connections
+
+
+# Longest request line read, in bytes
+MAX_REQUEST = 16 * 1024 * 1024
+
+def get_socket_path():
+    '''
+    Path of the build server socket.
+    From the setting STATICVIEWS_SOCKET, or beside STATICVIEWS_DIR,
+    e.g. 'site.sock'.
+    '''
+    path = getattr(settings, 'STATICVIEWS_SOCKET', None)
+    if (path is None):
+        base = Path(settings.STATICVIEWS_DIR)
+        path = base.with_name(base.name + '.sock')
+    return Path(path)
+
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # A request is a line of JSON. So is the response
+    def handle(self):
+        line = self.rfile.readline(MAX_REQUEST)
+        if (not(line)):
+            # Connected, and went e.g. a check for a live server
+            return
+        try:
+            request = json.loads(line)
+            if (not(isinstance(request, dict))):
+                raise ValueError('A request must be a JSON object')
+        except ValueError as ex:
+            response = {'ok': False, 'error': f'Bad request: {ex}'}
+        else:
+            response = self.server.dispatch(request)
+        try:
+            self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+        except BrokenPipeError:
+            # The client gave up. The job is done anyway
+            pass
+
+
+
+class BuildServer(socketserver.UnixStreamServer):
+    '''
+    Render pages on request, from a Unix socket.
+    Django is set up once, and the managers of STATIC_VIEWS entries
+    are made once, then kept warm, with their views, templates, and
+    URL handler. So a request to render a few pages takes the time to
+    render them, not to start. Requests are served one at a time.
+
+    Requests are JSON objects, with an 'action',
+    'ping'
+        Gives the names of the entries.
+    'render'
+        With 'model', a label e.g. 'blog.article', and 'pks', render
+        the objects' pages, and the pages which depend on them.
+        'created' true also renders pages listing the model. Or, with
+        'entry', a name, and 'targets', render those targets of the
+        entry, pks or URLs.
+    'delete'
+        With 'model' and 'pks', delete the objects' pages.
+    'build'
+        Build entries, as viewstaticmerge. 'entries' is a list of
+        name patterns, default all. 'incremental' and 'sync' as
+        viewstaticmerge.
+    Only the owner of the socket can connect.
+    path
+        Path of the socket.
+    worker
+        A QueueWorker, holding the warm managers.
+    '''
+    def __init__(self, path, worker):
+        self.path = Path(path)
+        self.worker = worker
+        self.actions = {
+            'ping': self.ping,
+            'render': self.render,
+            'delete': self.delete,
+            'build': self.build,
+        }
+        self.remove_stale()
+        super().__init__(os.fspath(self.path), RequestHandler)
+
+    def server_bind(self):
+        # The socket is made by bind(), so a chmod after leaves a gap 
+        # when others could connect. Bind under a umask which makes it
+        # private. The server is not yet serving, so nothing else is 
+        # making files
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+
+    def remove_stale(self):
+        # A socket left by a server which died. Refuse to replace a
+        # live one
+        if (not(self.path.exists())):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(os.fspath(self.path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.path.unlink(missing_ok=True)
+                return
+        raise OSError(f'A build server is running. socket:"{self.path}"')
+
+    def server_close(self):
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+
+    def dispatch(self, request):
+        '''
+        Run a request.
+        return
+            response, a dict with 'ok', and 'error' or results
+        '''
+        action = self.actions.get(request.get('action'))
+        if (action is None):
+            return {'ok': False, 'error': f"Unknown action. Must be one of {tuple(self.actions)}. value:\"{request.get('action')}\""}
+        start = perf_counter()
+
+        # As Django does around a request, so a connection which has
+        # timed out while idle is replaced
+        close_old_connections()
+        try:
+            response = action(request)
+        except Exception as ex:
+            return {'ok': False, 'error': f'{ex.__class__.__name__}: {ex}'}
+        finally:
+            close_old_connections()
+        response['ok'] = True
+        response['seconds'] = round(perf_counter() - start, 6)
+        return response
+
+    def ping(self, request):
+        return {'entries': [g.name for g in self.worker.managers]}
+
+    def render(self, request):
+        if (request.get('entry') is not None):
+            g = self.worker.by_name.get(request['entry'])
+            if (g is None):
+                raise ValueError(f"No entry named '{request['entry']}'")
+            targets = set(str(t) for t in request.get('targets', []))
+            return {'written': self.worker.refresh(g).update_targets(targets), 'deleted': g.delete_count}
+        action = 'create' if (request.get('created')) else 'save'
+        written, deleted = self.worker.render_changes({(request['model'], action): request['pks']})
+        return {'written': written, 'deleted': deleted}
+
+    def delete(self, request):
+        written, deleted = self.worker.render_changes({(request['model'], 'delete'): request['pks']})
+        return {'written': written, 'deleted': deleted}
+
+    def build(self, request):
+        patterns = request.get('entries') or ['*']
+        results = {}
+        for g in self.worker.managers:
+            if (not(any(fnmatch(g.name, p) for p in patterns))):
+                continue
+            self.worker.refresh(g)
+            g.incremental = bool(request.get('incremental'))
+            g.sync = bool(request.get('sync'))
+            written = g.create()
+            results[g.name] = {'written': written, 'deleted': g.delete_count}
+        return {'entries': results}
+
@@ -0,0 +1,86 @@
+'''
+Send jobs to a build server, from 'viewstaticdaemon'.
+
+    python -m static_models.daemon_client --socket site.sock render blog.article 12 13
+
+Imports nothing from Django, so the client starts in milliseconds. 
+The socket can also be given by the environment variable 
+STATICVIEWS_SOCKET. Prints the response, as JSON. Exits with 1 if the
+job failed.
+'''
+import os
+import sys
+import json
+import socket
+import argparse
+
+
+def send(path, request, timeout=None):
+    '''
+    Send a request to a build server.
+    request
+        dict, as BuildServer.
+    return
+        the response, a dict
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(os.fspath(path))
+        s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        data = b''.join(iter(lambda: s.recv(65536), b''))
+    return json.loads(data)
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Send jobs to a static_models build server')
+    parser.add_argument(
+        '--socket',
+        default=os.environ.get('STATICVIEWS_SOCKET'),
+        help="Path of the server socket (default is the environment variable STATICVIEWS_SOCKET)",
+    )
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for the job (default is no limit)')
+    actions = parser.add_subparsers(dest='action', required=True)
+    actions.add_parser('ping', help='List the entries of the server')
+    p = actions.add_parser('render', help="Render objects' pages, and pages depending on them")
+    p.add_argument('model', help="Model label e.g. 'blog.article'")
+    p.add_argument('pks', nargs='+')
+    p.add_argument('--created', action='store_true', help='The objects are new, so render pages listing the model too')
+    p = actions.add_parser('targets', help="Render targets of an entry, pks or URLs")
+    p.add_argument('entry', help='Name of the entry')
+    p.add_argument('targets', nargs='+')
+    p = actions.add_parser('delete', help="Delete objects' pages")
+    p.add_argument('model', help="Model label e.g. 'blog.article'")
+    p.add_argument('pks', nargs='+')
+    p = actions.add_parser('build', help='Build entries, as viewstaticmerge')
+    p.add_argument('--entry', action='append', default=[], help='Name pattern of entries to build. Can be given more than once (default is all)')
+    p.add_argument('-i', '--incremental', action='store_true', help='Only render objects changed since the last build')
+    p.add_argument('--sync', action='store_true', help='Delete files no longer generated')
+    return parser
+
+def make_request(options):
+    if (options.action == 'render'):
+        return {'action': 'render', 'model': options.model, 'pks': options.pks, 'created': options.created}
+    if (options.action == 'targets'):
+        return {'action': 'render', 'entry': options.entry, 'targets': options.targets}
+    if (options.action == 'delete'):
+        return {'action': 'delete', 'model': options.model, 'pks': options.pks}
+    if (options.action == 'build'):
+        return {'action': 'build', 'entries': options.entry, 'incremental': options.incremental, 'sync': options.sync}
+    return {'action': options.action}
+
+def main(argv=None):
+    parser = get_parser()
+    options = parser.parse_args(argv)
+    if (not(options.socket)):
+        parser.error('Give --socket, or set STATICVIEWS_SOCKET')
+    try:
+        response = send(options.socket, make_request(options), options.timeout)
+    except OSError as ex:
+        print(f'Can not reach the build server: {ex}', file=sys.stderr)
+        return 1
+    print(json.dumps(response))
+    return 0 if (response.get('ok')) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import sqlite3
+import contextvars
+from functools import wraps
+from pathlib import Path
+from django.conf import settings
+from django.db.models.query import ModelIterable, QuerySet
+from django.db.models.signals import post_init
+
+
+# Set of dependency keys for the render in progress, or None
+_recording = contextvars.ContextVar('static_models_recording', default=None)
+
+# True while QuerySet.get() runs
+_single = contextvars.ContextVar('static_models_single', default=False)
+_connected = False
+
+def model_key(model):
+    # Key for any change to a model table e.g. a new object. Only
+    # recorded for lists, as a new object can join a list, but never
+    # becomes an object fetched by pk or slug
+    return model._meta.label_lower
+
+def object_key(model, pk):
+    return f'{model._meta.label_lower}:{pk}'
+
+def _on_post_init(sender, instance, **kwargs):
+    touched = _recording.get()
+    if ((touched is not None) and (instance.pk is not None)):
+        touched.add(object_key(sender, instance.pk))
+
+def _watch_queries():
+    # QuerySet.get() runs its query like a list, so is marked, and
+    # any other query of model instances is recorded as a list. This
+    # also catches lists which found nothing
+    get = QuerySet.get
+    model_iter = ModelIterable.__iter__
+
+    @wraps(get)
+    def recorded_get(self, *args, **kwargs):
+        token = _single.set(True)
+        try:
+            return get(self, *args, **kwargs)
+        finally:
+            _single.reset(token)
+
+    @wraps(model_iter)
+    def recorded_iter(self):
+        touched = _recording.get()
+        if ((touched is not None) and not(_single.get())):
+            touched.add(model_key(self.queryset.model))
+        return model_iter(self)
+
+    QuerySet.get = recorded_get
+    ModelIterable.__iter__ = recorded_iter
+
+def add_object(touched, obj, depth=2):
+    '''
+    Add an object, and related objects already loaded into it, to a
+    set of dependency keys. Related objects loaded by select_related()
+    or prefetch_related() are made before a render, so are not seen
+    by the recorder. Prefetched objects are lists, so their model is
+    added too.
+    '''
+    if ((obj is None) or (obj.pk is None)):
+        return
+    touched.add(object_key(obj.__class__, obj.pk))
+    if (depth == 0):
+        return
+    state = getattr(obj, '_state', None)
+    for related in getattr(state, 'fields_cache', {}).values():
+        if (hasattr(related, '_state')):
+            add_object(touched, related, depth - 1)
+    for qs in getattr(obj, '_prefetched_objects_cache', {}).values():
+        if (hasattr(qs, 'model')):
+            touched.add(model_key(qs.model))
+        for related in (getattr(qs, '_result_cache', None) or ()):
+            add_object(touched, related, depth - 1)
+
+
+
+class record():
+    '''
+    Context manager. Collect keys of the model objects loaded while
+    active, in this thread or task.
+    objs
+        Objects already loaded, to add at the start.
+
+        with record(obj) as touched:
+            ...render...
+    '''
+    def __init__(self, *objs):
+        global _connected
+        if (not(_connected)):
+            # Only connected when used. Otherwise every model init in
+            # the process would pay for it
+            post_init.connect(_on_post_init, dispatch_uid='static_models_record')
+            _watch_queries()
+            _connected = True
+        self.touched = set()
+        for obj in objs:
+            add_object(self.touched, obj)
+
+    def __enter__(self):
+        self.token = _recording.set(self.touched)
+        return self.touched
+
+    def __exit__(self, *args):
+        _recording.reset(self.token)
+
+
+
+def get_index_path():
+    '''
+    Path of the dependency index.
+    From the setting STATICVIEWS_DEPENDENCIES, or beside
+    STATICVIEWS_DIR, e.g. 'site.deps.sqlite3'.
+    '''
+    path = getattr(settings, 'STATICVIEWS_DEPENDENCIES', None)
+    if (path is None):
+        base = Path(settings.STATICVIEWS_DIR)
+        path = base.with_name(base.name + '.deps.sqlite3')
+    return Path(path)
+
+def get_index():
+    return DependencyIndex(get_index_path())
+
+
+
+class DependencyIndex():
+    '''
+    Which generated pages depend on which model objects.
+    A page is keyed by the name of the manager that made it, and a
+    target. The target is the pk for object pages, the URL for URL
+    pages, and empty for one-off pages.
+
+    Kept in SQLite, so it can be updated page by page, by several
+    processes, and looked up by object without loading it all. The
+    connection is opened on first use, so an index can be made
+    before a fork.
+
+    Changes to pages are held, then written 'batch' pages at a time,
+    each batch a short transaction. SQLite has one writer at a time,
+    so processes rendering together only wait for each other's
+    writes, not for each other's renders.
+    path
+        Path of the database file.
+    batch
+        Pages held before a write.
+    '''
+    def __init__(self, path, batch=100):
+        self.path = Path(path)
+        self.batch = batch
+        self._db = None
+
+        # (entry, target) -> set of dependency keys. Empty to remove
+        self.pending = {}
+
+    @property
+    def db(self):
+        if (self._db is None):
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS deps (
+                    entry TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    dep TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS deps_dep ON deps (dep);
+                CREATE INDEX IF NOT EXISTS deps_page ON deps (entry, target);
+            ''')
+        return self._db
+
+    def set(self, entry, target, deps):
+        '''
+        Replace the dependencies of a page.
+        '''
+        self.pending[(entry, str(target))] = set(deps)
+        if (len(self.pending) >= self.batch):
+            self.flush()
+
+    def remove(self, entry, target):
+        self.set(entry, target, ())
+
+    def flush(self):
+        '''
+        Write held changes, in one transaction.
+        '''
+        if (not(self.pending)):
+            return
+        with self.db:
+            for (entry, target), deps in self.pending.items():
+                self.db.execute('DELETE FROM deps WHERE entry = ? AND target = ?', (entry, target))
+                self.db.executemany(
+                    'INSERT INTO deps (entry, target, dep) VALUES (?, ?, ?)',
+                    ((entry, target, dep) for dep in deps)
+                )
+        self.pending = {}
+
+    def dependents(self, deps):
+        '''
+        Return pages depending on any of the given keys.
+        return
+            set of (entry, target)
+        '''
+        self.flush()
+        pages = set()
+        deps = list(deps)
+        # Keep under SQLite's limit on parameters
+        for i in range(0, len(deps), 500):
+            chunk = deps[i : i + 500]
+            rows = self.db.execute(
+                'SELECT DISTINCT entry, target FROM deps WHERE dep IN ({})'.format(
+                    ','.join('?' * len(chunk))
+                ),
+                chunk
+            )
+            pages.update(rows)
+        return pages
+
+    def clear(self, entry):
+        self.pending = {k: v for k, v in self.pending.items() if (k[0] != entry)}
+        with self.db:
+            self.db.execute('DELETE FROM deps WHERE entry = ?', (entry,))
+
+    def commit(self):
+        self.flush()
+        if (self._db is not None):
+            self._db.commit()
+
+    def close(self):
+        self.flush()
+        if (self._db is not None):
+            self._db.commit()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,244 @@
+import json
+import time
+from pathlib import Path
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from static_models.dependencies import get_index
+from static_models.view_generator import normalize_viewsetting, manager_from_setting
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX. Appends of a line are near-enough atomic
+    fcntl = None
+
+
+def get_queue_path():
+    '''
+    Path of the queue file.
+    From the setting STATICVIEWS_QUEUE, or beside STATICVIEWS_DIR,
+    e.g. 'site.queue'.
+    '''
+    path = getattr(settings, 'STATICVIEWS_QUEUE', None)
+    if (path is None):
+        base = Path(settings.STATICVIEWS_DIR)
+        path = base.with_name(base.name + '.queue')
+    return Path(path)
+
+def get_queue():
+    return FileQueue(get_queue_path())
+
+
+
+class FileQueue():
+    '''
+    A queue of objects to regenerate.
+    Held in a file, a line of JSON for each change, so any process
+    (e.g. web workers handling admin saves) can add to it cheaply, and
+    a separate worker can take from it. The file is locked while in
+    use.
+    path
+        Path of the queue file.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def lock(self, fd):
+        if (fcntl is not None):
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def put(self, label, pk, action='save'):
+        '''
+        Add a change to the queue.
+        label
+            Model label e.g. 'page.page'
+        pk
+            Written as JSON. A pk JSON can not hold, e.g. a UUID, is
+            written as a string
+        action
+            'create', 'save' or 'delete'
+        '''
+        line = json.dumps({
+            'model': label,
+            'pk': pk,
+            'action': action,
+            'time': time.time()
+        }, cls=DjangoJSONEncoder) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as fd:
+            self.lock(fd)
+            fd.write(line)
+
+    def take(self):
+        '''
+        Remove and return all changes on the queue.
+        return
+            list of dicts, oldest first
+        '''
+        try:
+            fd = open(self.path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            return []
+        with fd:
+            self.lock(fd)
+            lines = fd.readlines()
+            fd.seek(0)
+            fd.truncate()
+        items = []
+        for line in lines:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                # A broken line, maybe a crash mid-write. Skip.
+                pass
+        return items
+
+
+
+class QueueWorker():
+    '''
+    Take changes from a queue, and regenerate pages.
+    Changes to the same object are coalesced. An object is only
+    rendered when it has not changed for 'debounce' seconds, so a
+    burst of saves renders once. Ready objects are rendered in
+    batches, one batch per STATIC_VIEWS entry.
+
+    If entries track dependencies, pages which loaded a changed object
+    are rendered too. A new object also renders pages which queried a
+    list of its model.
+    queue
+        A FileQueue
+    debounce
+        Seconds an object must be unchanged before it is rendered.
+    kwargs
+        Options for the managers e.g. extension.
+    '''
+    def __init__(self, queue, debounce=2.0, **kwargs):
+        self.queue = queue
+        self.debounce = debounce
+        self.manager_options = kwargs
+
+        # (label, pk) -> (action, time of last change)
+        self.pending = {}
+
+        # Managers are made once, then kept warm
+        self.managers = self.get_managers()
+        self.by_name = {g.name: g for g in self.managers}
+        self.by_label = {}
+        for g in self.managers:
+            if (g.query):
+                self.by_label.setdefault(g.View.model._meta.label_lower, []).append(g)
+        self.index = None
+        if (any(g.deps is not None for g in self.managers)):
+            self.index = get_index()
+
+    def get_managers(self):
+        managers = []
+        for vs in getattr(settings, 'STATIC_VIEWS', []):
+            if (vs.get('view') or vs.get('urls')):
+                vs = normalize_viewsetting(vs)
+                managers.append(manager_from_setting(vs, **self.manager_options))
+        return managers
+
+    def refresh(self, g):
+        # Other processes may have written since the manager was made
+        g.reset()
+        return g
+
+    def poll(self):
+        '''
+        Move changes from the queue to pending.
+        '''
+        for item in self.queue.take():
+            key = (item['model'], self.to_pk(item['model'], item['pk']))
+            action = item['action']
+            old = self.pending.get(key)
+            # A save after a create is still new, to list pages
+            if (old and (old[0] == 'create') and (action == 'save')):
+                action = 'create'
+            self.pending[key] = (action, item['time'])
+
+    def to_pk(self, label, value):
+        # A pk from the queue, as the model's pk e.g. a UUID from a
+        # string, so changes to an object coalesce
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError):
+            return value
+        try:
+            return model._meta.pk.to_python(value)
+        except ValidationError:
+            return value
+
+    def take_ready(self, now=None):
+        '''
+        Remove and return pending changes older than the debounce.
+        return
+            dict of (label, action) -> list of pks
+        '''
+        if (now is None):
+            now = time.time()
+        ready = {}
+        for key, (action, stamp) in list(self.pending.items()):
+            if (now - stamp >= self.debounce):
+                del self.pending[key]
+                label, pk = key
+                ready.setdefault((label, action), []).append(pk)
+        return ready
+
+    def run_once(self, now=None):
+        '''
+        Poll, then render what is ready.
+        return
+            (count written, count deleted)
+        '''
+        self.poll()
+        return self.render_changes(self.take_ready(now))
+
+    def render_changes(self, ready):
+        '''
+        Render, or delete, the pages of changed objects, and the pages
+        which depend on them.
+        ready
+            dict of (label, action) -> list of pks
+        return
+            (count written, count deleted)
+        '''
+        written = 0
+        deleted = 0
+
+        # manager -> targets to render
+        pages = {}
+        for (label, action), pks in ready.items():
+            direct = self.by_label.get(label, [])
+            for g in direct:
+                if (action == 'delete'):
+                    deleted += self.refresh(g).delete_objects(pks)
+                else:
+                    pages.setdefault(g, set()).update(str(pk) for pk in pks)
+            if (self.index is not None):
+                gone = set(str(pk) for pk in pks) if (action == 'delete') else set()
+                # As dependencies.object_key()
+                keys = [f'{label}:{pk}' for pk in pks]
+                if (action == 'create'):
+                    keys.append(label)
+                for entry, target in self.index.dependents(keys):
+                    g = self.by_name.get(entry)
+                    if ((g is None) or ((g in direct) and (target in gone))):
+                        # Not configured now, or the page was deleted
+                        continue
+                    pages.setdefault(g, set()).add(target)
+        for g, targets in pages.items():
+            written += self.refresh(g).update_targets(targets)
+            # Objects saved out of the query
+            deleted += g.delete_count
+        return (written, deleted)
+
+    def run(self, interval=1.0):
+        '''
+        Poll and render, forever.
+        '''
+        while True:
+            self.run_once()
+            time.sleep(interval)
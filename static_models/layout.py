@@ -0,0 +1,55 @@
+import hashlib
+from django.core.exceptions import ImproperlyConfigured
+
+
+FANOUT_MODES = (None, 'hash', 'prefix')
+
+# Characters in each directory name. Two hex characters make 256
+# directories a level
+FANOUT_WIDTH = 2
+
+def check_fanout(fanout, depth):
+    if (fanout not in FANOUT_MODES):
+        raise ImproperlyConfigured(f'Unknown fanout. Must be one of {FANOUT_MODES}. value:"{fanout}"')
+    if (depth < 1):
+        raise ImproperlyConfigured(f'A fanout depth must be 1 or more. value:{depth}')
+
+def fanout_dirs(name, fanout, depth=2):
+    '''
+    Directories to put a file in, so no one directory holds too many.
+    'hash' takes the directories from a hash of the name, so spreads
+    evenly. 'prefix' takes them from the start of the name, padded
+    with '0' if short, so a file can be found by eye e.g. '12345' is
+    in '12/34'. The prefix is of the name before any '.'.
+    name
+        Name of the file, with any extension.
+    fanout
+        None, 'hash' or 'prefix'.
+    depth
+        Levels of directories.
+    return
+        list of directory names. Empty if fanout is None.
+    '''
+    if (fanout is None):
+        return []
+    size = FANOUT_WIDTH * depth
+    if (fanout == 'hash'):
+        key = hashlib.blake2b(name.encode('utf-8'), digest_size=16).hexdigest()[:size]
+    else:
+        # Not the extension
+        key = name.split('.', 1)[0].zfill(size)[:size]
+    return [key[i:i + FANOUT_WIDTH] for i in range(0, size, FANOUT_WIDTH)]
+
+def fanout_path(name, fanout, depth=2):
+    '''
+    Path of a file under its fanout directories, as a posix string
+    e.g. '3f/a0/12345'.
+    '''
+    return '/'.join((*fanout_dirs(name, fanout, depth), name))
+
+def strip_fanout(path, depth=2):
+    '''
+    Name of a file from its path under fanout directories, as made by
+    fanout_path() e.g. '3f/a0/12345' is '12345'.
+    '''
+    return path.split('/', depth)[-1]
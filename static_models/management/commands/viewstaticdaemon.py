@@ -0,0 +1,62 @@
+import sys
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from static_models.daemon import BuildServer, get_socket_path
+from static_models.jobqueue import QueueWorker
+from static_models.writer import COMPRESSORS
+
+
+
+
+class Command(BaseCommand):
+    help = "Run a build server, keeping managers warm, taking jobs on a Unix socket. Send jobs with 'python -m static_models.daemon_client'"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-e',
+            '--html_extension',
+            action='store_true',
+            help="Add '.html' extension to generated files.",
+        )
+        parser.add_argument(
+            '-z',
+            '--compress',
+            action='append',
+            choices=tuple(COMPRESSORS),
+            help="Also write a compressed copy of each file. Can be given twice, for 'gzip' and 'br'. Overrides the 'compress' of entries",
+        )
+        parser.add_argument(
+            '--socket',
+            help="Path of the socket. Default is the setting STATICVIEWS_SOCKET, or beside STATICVIEWS_DIR e.g. 'site.sock'",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            settings.STATICVIEWS_DIR
+        except AttributeError:
+            raise CommandError('The static_models app requires a setting STATICVIEWS_DIR to be defined.')
+
+        extension = ''
+        if (options['html_extension']):
+            extension = 'html'
+        worker = QueueWorker(
+            None,
+            extension=extension,
+            compress=options['compress'],
+            cache_templates=True,
+        )
+        try:
+            server = BuildServer(options['socket'] or get_socket_path(), worker)
+        except OSError as ex:
+            raise CommandError(str(ex))
+        if (options['verbosity'] > 0):
+            print("Info: Build server on '{}', {} entries".format(server.path, len(worker.managers)))
+        # Stop cleanly when a service manager stops the server
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
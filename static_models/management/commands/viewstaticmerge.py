@@ -1,10 +1,93 @@
+import re
+import argparse
+import operator
+from datetime import datetime, timedelta
+from fnmatch import fnmatch
+from functools import reduce
+from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand, CommandError
-from static_models.view_generator import ViewStaticManager
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from static_models.view_generator import (
+    normalize_viewsetting, manager_from_setting, entry_filepath, entry_name,
+    plan_entry, get_writer
+)
+from static_models.releases import get_releases
+from static_models.pack import get_pack_path
+from static_models.storage import get_storage_setting
+from static_models.sitemap import get_site_url, site_pages, write_sitemaps, write_page_index
+from static_models.profiling import PROFILERS
+from static_models.writer import FSYNC_POLICIES, COMPRESSORS
 #from static_models.settings import settings
 from django.conf import settings
 
 
 
+def shard_type(value):
+    # 'i/N' -> (i, N)
+    try:
+        shard, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Must be 'i/N' e.g. '2/4'. value:'{value}'")
+    if (not(1 <= shard <= count)):
+        raise argparse.ArgumentTypeError(f"Shard must be from 1 to N. value:'{value}'")
+    return (shard, count)
+
+
+
+def filter_type(value):
+    # 'field__lookup=value' -> (field__lookup, value). Values are 
+    # strings, Django converts for the field, except lists and flags.
+    lookup, sep, v = value.partition('=')
+    if (not(sep) or not(lookup)):
+        raise argparse.ArgumentTypeError(f"Must be 'field=value' e.g. 'category__slug=news'. value:'{value}'")
+    if (lookup.endswith('__in') or lookup.endswith('__range')):
+        v = v.split(',')
+    elif (lookup.endswith('__isnull')):
+        v = v.lower() in ('1', 'true', 'yes')
+    return (lookup, v)
+
+def pk_type(value):
+    # '1,2,7' or '100-200', or a mix. '100-' or '-200' are open ranges.
+    # -> Q
+    qs = []
+    pks = []
+    for part in value.split(','):
+        m = re.fullmatch(r'(\w*)-(\w*)', part.strip())
+        if (m is None):
+            pks.append(part.strip())
+        elif (m[1] and m[2]):
+            qs.append(Q(pk__gte=m[1], pk__lte=m[2]))
+        elif (m[1] or m[2]):
+            qs.append(Q(pk__gte=m[1]) if (m[1]) else Q(pk__lte=m[2]))
+        else:
+            raise argparse.ArgumentTypeError(f"Must be pks and ranges e.g. '3,7,100-200'. value:'{value}'")
+    if (pks):
+        qs.append(Q(pk__in=pks))
+    return reduce(operator.or_, qs)
+
+def since_type(value):
+    # A date, a datetime, or an age e.g. '3d', '12h', '30m'
+    m = re.fullmatch(r'(\d+)([dhm])', value)
+    if (m):
+        unit = {'d': 'days', 'h': 'hours', 'm': 'minutes'}[m[2]]
+        return timezone.now() - timedelta(**{unit: int(m[1])})
+    dt = parse_datetime(value)
+    if (dt is None):
+        d = parse_date(value)
+        if (d is None):
+            raise argparse.ArgumentTypeError(f"Must be a date, datetime, or age e.g. '2024-05-01', '3d', '12h'. value:'{value}'")
+        dt = datetime(d.year, d.month, d.day)
+    # Compared with the database, so aware only if the project is
+    if (settings.USE_TZ and timezone.is_naive(dt)):
+        dt = timezone.make_aware(dt)
+    elif (not(settings.USE_TZ) and timezone.is_aware(dt)):
+        dt = timezone.make_naive(dt)
+    return dt
+
+
 
 class Command(BaseCommand):
     help = 'Create/update static files'
@@ -13,7 +96,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--sync',
             action='store_true',
-            help="Before generation, delete existing files.",
+            help="After generation, delete files generated before, but not this time.",
         )
         parser.add_argument(
             '-o',
@@ -27,23 +110,137 @@ class Command(BaseCommand):
             action='store_true',
             help="Add '.html' extension to generated files.",
         )
+        parser.add_argument(
+            '-i',
+            '--incremental',
+            action='store_true',
+            help="Only render objects changed since the last build, delete files of objects removed.",
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=1,
+            help="Number of processes to render with (default is 1)",
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async_urls',
+            help="Render URLs concurrently, through Django's ASGI handler",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help="With --async, the most URLs in progress at once (default is 10)",
+        )
+        parser.add_argument(
+            '--fsync',
+            choices=FSYNC_POLICIES,
+            default='none',
+            help="When to fsync written files (default is 'none')",
+        )
+        parser.add_argument(
+            '--write-threads',
+            type=int,
+            default=0,
+            help="Number of threads to write files with (default is 0, write while rendering)",
+        )
+        parser.add_argument(
+            '-z',
+            '--compress',
+            action='append',
+            choices=tuple(COMPRESSORS),
+            help="Also write a compressed copy of each file. Can be given twice, for 'gzip' and 'br'. Overrides the 'compress' of entries",
+        )
+        parser.add_argument(
+            '--stats',
+            help="Write timings of each page, and a summary of each entry, to this file as lines of JSON. '-' for stdout",
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help="With --stats, the slowest pages to summarise (default is 10)",
+        )
+        parser.add_argument(
+            '--profile',
+            help="Save a profile of each entry to this directory",
+        )
+        parser.add_argument(
+            '--profiler',
+            choices=PROFILERS,
+            default='cprofile',
+            help="With --profile, the profiler to use (default is 'cprofile')",
+        )
+        parser.add_argument(
+            '--shard',
+            type=shard_type,
+            help="Render one shard of the build, 'i/N' e.g. '2/4', for building on several machines",
+        )
+        parser.add_argument(
+            '--merge',
+            type=int,
+            metavar='N',
+            help="After all N shards are built, combine their manifests and delete orphans",
+        )
+        parser.add_argument(
+            '--entry',
+            action='append',
+            default=[],
+            help="Only build entries with this name, or view path. Can be a pattern e.g. 'blog.views.*'. Can be given more than once",
+        )
+        parser.add_argument(
+            '--filter',
+            type=filter_type,
+            action='append',
+            default=[],
+            help="Only render objects matching a field lookup e.g. 'category__slug=news'. Can be given more than once",
+        )
+        parser.add_argument(
+            '--pk',
+            type=pk_type,
+            action='append',
+            default=[],
+            help="Only render objects with these pks, or in these ranges e.g. '3,7,100-200'",
+        )
+        parser.add_argument(
+            '--since',
+            type=since_type,
+            help="Only render objects changed since a date, datetime or age e.g. '2024-05-01', '3d', '12h'. Needs a 'modified_field'",
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Report what would be rendered, but render nothing",
+        )
+        parser.add_argument(
+            '--storage',
+            help="Alias in STORAGES to save pages to, in place of files e.g. S3. Default is the setting STATICVIEWS_STORAGE",
+        )
+        parser.add_argument(
+            '--sitemap',
+            action='store_true',
+            help="Also write sitemaps of every generated page, from the manifests. Needs a setting STATICVIEWS_URL",
+        )
+        parser.add_argument(
+            '--page-index',
+            action='store_true',
+            help="Also write 'pages.json', an index of every generated page with its hash and time last modified",
+        )
+        parser.add_argument(
+            '--release',
+            action='store_true',
+            help="Build into a new release directory, then switch STATICVIEWS_DIR to it",
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=3,
+            help="With --release, old releases to keep for rollback (default is 3)",
+        )
 
-    def normalize_viewsetting(self, vs):
-        if (not('view' in vs)):
-            vs['view'] = None
-        if (not('query' in vs)):
-            vs['query'] = None
-        if (not('urls' in vs)):
-            vs['urls'] = []
-        if (not('filename' in vs)):
-            vs['filename'] = None
-        if (not('filename_from_attribute' in vs)):
-            vs['filename_from_attribute'] = 'pk'
-        if (not('filepath' in vs)):
-            vs['filepath'] = None
-        return vs
-
-                    
     def handle(self, *args, **options):         
         extension = ''
         if (options['html_extension']):
@@ -64,29 +261,171 @@ class Command(BaseCommand):
                 )
             else:
                 valid_entries.append(e)                
-        normalised_entries = [self.normalize_viewsetting(e) for e in valid_entries]
+        normalised_entries = [normalize_viewsetting(e) for e in valid_entries]
+
+        filters = []
+        if (options['filter']):
+            filters.append(dict(options['filter']))
+        if (options['pk']):
+            filters.append(reduce(operator.or_, options['pk']))
+        options['filters'] = filters
+
+        if (options['dry_run']):
+            self.dry_run(normalised_entries, extension, options)
+            return
+
+        if (options['stats'] and (options['stats'] != '-')):
+            # Managers, and their worker processes, append
+            open(options['stats'], 'w').close()
             
+        if (options['release'] and (options['shard'] or options['merge'])):
+            raise CommandError('--release can not be used with --shard or --merge. Each machine would make its own release')
+        if (options['release'] and (options['storage'] or get_storage_setting())):
+            raise CommandError('--release can not be used with a storage. Releases are directories of files')
+        if (options['release'] and get_pack_path()):
+            raise CommandError('--release can not be used with STATICVIEWS_PACK. The pack is one file, copy it to release')
+        if ((options['sitemap'] or options['page_index']) and options['shard']):
+            raise CommandError('--sitemap and --page-index need every page. Give them to --merge')
+        if (options['sitemap']):
+            try:
+                get_site_url()
+            except ImproperlyConfigured as ex:
+                raise CommandError(str(ex))
+        if (options['merge']):
+            self.merge(normalised_entries, extension, options)
+            self.site_index(normalised_entries, options)
+            return
+
+        if (not(options['release'])):
+            self.generate(normalised_entries, extension, options)
+            self.site_index(normalised_entries, options)
+            return
+
+        # Build a new release beside the live one, then swap
+        releases = get_releases()
+        basepath = releases.new()
+        try:
+            self.generate(normalised_entries, extension, options, basepath)
+            self.site_index(normalised_entries, options, basepath)
+        except BaseException:
+            releases.discard(basepath)
+            raise
+        releases.switch(basepath.name)
+        pruned = releases.prune(options['keep'])
+        if (options['verbosity'] > 0):
+            print("Release '{}' is current".format(basepath.name))
+            if (pruned):
+                print("{} old release(s) deleted".format(len(pruned)))
+
+    def site_index(self, normalised_entries, options, basepath=None):
+        # Sitemaps and the page index are of every entry, built now or
+        # not, from the records of the build
+        if (not(options['sitemap'] or options['page_index'])):
+            return
+        basepath = Path(basepath or settings.STATICVIEWS_DIR)
+        fanouts = {entry_name(vs, basepath): vs['fanout_depth'] for vs in normalised_entries if (vs['fanout'])}
+        pages = site_pages(basepath, [entry_filepath(vs, basepath) for vs in normalised_entries], fanouts)
+        writer = get_writer(basepath, options['fsync'], storage=options['storage'])
+        if (options['sitemap']):
+            count = write_sitemaps(writer, basepath, pages, get_site_url())
+            if (options['verbosity'] > 0):
+                print("{} sitemap(s) written, of {} page(s)".format(count, len(pages)))
+        if (options['page_index']):
+            write_page_index(writer, basepath, pages)
+            if (options['verbosity'] > 0):
+                print("Index written, of {} page(s)".format(len(pages)))
+        writer.close()
+
+    def applies(self, vs, options):
+        # Object filters only make sense for entries with a query
+        if ((options['filters'] or options['since']) and not(vs['query'])):
+            return False
+        if (options['since'] and not(vs['modified_field'])):
+            return False
+        return True
+
+    def selected(self, vs, options, basepath=None):
+        # Before a manager is made, as making one sets up its output
+        if (not(options['entry'])):
+            return True
+        names = [entry_name(vs, basepath)]
+        if (isinstance(vs['view'], str)):
+            names.append(vs['view'])
+        return any(fnmatch(name, pattern) for pattern in options['entry'] for name in names)
+
+    def dry_run(self, normalised_entries, extension, options):
+        for vs in normalised_entries:
+            if (not(self.applies(vs, options)) or not(self.selected(vs, options))):
+                continue
+            targets = plan_entry(
+                vs,
+                incremental=options['incremental'],
+                shard=options['shard'],
+                filters=options['filters'],
+                since=options['since'],
+            )
+            basepath = Path(settings.STATICVIEWS_DIR)
+            location = entry_filepath(vs, basepath).relative_to(basepath.parent)
+            print("{} page(s) would be rendered at '{}' ({})".format(len(targets), location, entry_name(vs)))
+            if (options['verbosity'] > 1):
+                for target in targets:
+                    print('    ' + str(target))
+
+    def merge(self, normalised_entries, extension, options):
+        for vs in normalised_entries:
+            if (not(self.selected(vs, options))):
+                continue
+            # Orphans are deleted by the writer the shards used
+            g = manager_from_setting(
+                vs,
+                extension=extension,
+                incremental=options['incremental'],
+                fsync=options['fsync'],
+                write_threads=options['write_threads'],
+                compress=options['compress'],
+                storage=options['storage'],
+            )
+            try:
+                count = g.merge_shards(options['merge'])
+            except FileNotFoundError as ex:
+                raise CommandError(str(ex))
+            if (options['verbosity'] > 0):
+                print("{} shard(s) merged, {} static file(s) deleted at '{}'".format(options['merge'], count, g.location))
+
+    def generate(self, normalised_entries, extension, options, basepath=None):
         # ok, generate
         count = 0
 
-        if (options['sync'] and (options['verbosity'] > 0)):
-            self.stdout.write(
-                "Info: Directories will be cleared before generation"
-            )        
-            
         # This is defended to do as much as possible
         for vs in normalised_entries:
+            if (not(self.applies(vs, options))):
+                continue
             g = None
             try:
-                g = ViewStaticManager(
-                    vs['view'],
-                    vs['query'], 
-                    vs['urls'],
-                    vs['filename'],
-                    vs['filename_from_attribute'],
-                    vs['filepath'],
+                if (not(self.selected(vs, options, basepath))):
+                    continue
+                g = manager_from_setting(
+                    vs,
                     overwrite=options['overwrite'],
                     extension=extension,
+                    workers=options['jobs'],
+                    incremental=options['incremental'],
+                    sync=options['sync'],
+                    fsync=options['fsync'],
+                    write_threads=options['write_threads'],
+                    compress=options['compress'],
+                    async_urls=options['async_urls'],
+                    concurrency=options['concurrency'],
+                    basepath=basepath,
+                    shard=options['shard'],
+                    filters=options['filters'],
+                    since=options['since'],
+                    stats=options['stats'],
+                    stats_top=options['top'],
+                    profile=options['profile'],
+                    profiler=options['profiler'],
+                    storage=options['storage'],
+                    cache_templates=True,
                 )
             except Exception as ex:
                 self.stdout.write(
@@ -95,11 +434,9 @@ class Command(BaseCommand):
                 self.stdout.write(
                     f"WARNING: Data from a setting failed. setting{vs}"
                 )    
-            if g:
-                delete_count = 0
-                if (options['sync']):
-                    delete_count = g.delete()
-                    
+            if (g):
                 count = g.create()
                 if (options['verbosity'] > 0):
                     print("{} static file(s) created at '{}'".format(count, g.location))
+                    if (g.delete_count):
+                        print("{} static file(s) deleted at '{}'".format(g.delete_count, g.location))
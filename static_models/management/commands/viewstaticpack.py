@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from static_models.pack import Pack, get_pack_path
+
+
+
+
+class Command(BaseCommand):
+    help = "Show the size of the pack in STATICVIEWS_PACK, or compact it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--compact',
+            action='store_true',
+            help="Rewrite the pack without replaced and deleted pages",
+        )
+
+    def handle(self, *args, **options):
+        path = get_pack_path()
+        if (path is None):
+            raise CommandError('The command requires a setting STATICVIEWS_PACK to be defined.')
+        if (not(path.is_file())):
+            raise CommandError(f"No pack at '{path}'")
+
+        pack = Pack(path)
+        try:
+            if (options['compact']):
+                before, after = pack.compact()
+                if (options['verbosity'] > 0):
+                    print("Pack compacted from {} to {} bytes".format(before, after))
+                return
+            stats = pack.stats()
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        # The rest is replaced and deleted pages, and old indexes
+        print("{} page(s), {} bytes of pages in a pack of {} bytes".format(stats['pages'], stats['live'], stats['size']))
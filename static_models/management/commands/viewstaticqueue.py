@@ -0,0 +1,74 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from static_models.jobqueue import get_queue, QueueWorker
+from static_models.writer import COMPRESSORS
+
+
+
+
+class Command(BaseCommand):
+    help = 'Regenerate static files from queued model changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-e',
+            '--html_extension',
+            action='store_true',
+            help="Add '.html' extension to generated files.",
+        )
+        parser.add_argument(
+            '-z',
+            '--compress',
+            action='append',
+            choices=tuple(COMPRESSORS),
+            help="Also write a compressed copy of each file. Can be given twice, for 'gzip' and 'br'. Overrides the 'compress' of entries",
+        )
+        parser.add_argument(
+            '--debounce',
+            type=float,
+            default=2.0,
+            help="Seconds an object must be unchanged before it is rendered (default is 2)",
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help="Seconds between polls of the queue (default is 1)",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Render everything queued, then exit",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            settings.STATICVIEWS_DIR
+        except AttributeError:
+            raise CommandError('The static_models app requires a setting STATICVIEWS_DIR to be defined.')
+
+        extension = ''
+        if (options['html_extension']):
+            extension = 'html'
+        worker = QueueWorker(
+            get_queue(),
+            debounce=options['debounce'],
+            extension=extension,
+            compress=options['compress'],
+            cache_templates=True,
+        )
+        if (options['once']):
+            # No waiting for the debounce
+            written, deleted = worker.run_once(now=time.time() + options['debounce'])
+            if (options['verbosity'] > 0):
+                print("{} static file(s) created, {} deleted".format(written, deleted))
+            return
+
+        if (options['verbosity'] > 0):
+            print("Info: Watching queue '{}'".format(worker.queue.path))
+        while True:
+            written, deleted = worker.run_once()
+            if ((written or deleted) and (options['verbosity'] > 0)):
+                print("{} static file(s) created, {} deleted".format(written, deleted))
+            time.sleep(options['interval'])
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from static_models.releases import get_releases
+
+
+
+
+class Command(BaseCommand):
+    help = "List releases made by 'viewstaticmerge --release', or switch between them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'name',
+            nargs='?',
+            help="Make this release current",
+        )
+        parser.add_argument(
+            '--rollback',
+            action='store_true',
+            help="Make the release before the current one current",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            settings.STATICVIEWS_DIR
+        except AttributeError:
+            raise CommandError('The static_models app requires a setting STATICVIEWS_DIR to be defined.')
+
+        releases = get_releases()
+        versions = releases.versions()
+        current = releases.current()
+        name = options['name']
+        if (options['rollback']):
+            older = [v for v in versions if (current is None) or (v < current)]
+            if (not(older)):
+                raise CommandError('No release before the current one')
+            name = older[-1]
+        if (name):
+            try:
+                releases.switch(name)
+            except ValueError as ex:
+                raise CommandError(str(ex))
+            if (options['verbosity'] > 0):
+                print("Release '{}' is current".format(name))
+            return
+
+        for v in versions:
+            print(('* ' if (v == current) else '  ') + v)
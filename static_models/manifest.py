@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+
+
+# Name of the manifest file, in each output directory
+MANIFEST_NAME = '.static_models.json'
+
+def new_hash():
+    '''
+    Return a hash object, for content given in parts.
+    hexdigest() is the same as content_hash() of the whole.
+    '''
+    return hashlib.blake2b(digest_size=16)
+
+def content_hash(content):
+    '''
+    Return a hash of bytes, as a hex string.
+    '''
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def shard_manifest_name(entry, shard, count):
+    '''
+    Name of the manifest written by one shard of a build, for one
+    manager.
+    '''
+    key = content_hash(entry.encode())[:8]
+    return f'.static_models.{key}.shard-{shard}-of-{count}.json'
+
+def in_shard(key, shard, count):
+    '''
+    Is a pk or URL in a shard?
+    From a hash of the key, so the same on every machine. Shards are 
+    numbered from 1.
+    '''
+    return (int(content_hash(str(key).encode())[:8], 16) % count) + 1 == shard
+
+def file_hash(path, chunk_size=65536):
+    '''
+    Return a hash of a file's content, as a hex string.
+    Same as content_hash(), but the file is read in chunks.
+    '''
+    h = new_hash()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+
+class Manifest():
+    '''
+    A record of the files generated into a directory.
+    The record is a dict of filenames, relative to the directory, each
+    to a dict of data about the file. The data always holds a hash of
+    the file content, so a generator can tell if new content is the
+    same as the old, without reading the file.
+
+    The manifest also records the time of the last build for each 
+    manager that writes to the directory, keyed by the manager name.
+
+    Changes are held in memory until save(). On save, the changes are
+    applied to whatever is on disk, so managers that share a directory
+    do not lose each others records.
+    dirpath
+        Directory the manifest records.
+    name
+        Filename of the manifest. Default is MANIFEST_NAME.
+    '''
+    def __init__(self, dirpath, name=MANIFEST_NAME):
+        self.path = Path(dirpath) / name
+
+        # partial is for a shard manifest. True if the shard rendered 
+        # only some of its targets e.g. an incremental build
+        self.files, self.builds, self.partial = self.read()
+
+        # filename -> record, or None if removed
+        self.changes = {}
+        self.build_changes = {}
+        self.cleared = False
+
+    def read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fd:
+                data = json.load(fd)
+        except (FileNotFoundError, ValueError):
+            # Missing or broken. Either way, start fresh
+            return ({}, {}, False)
+        return (data.get('files', {}), data.get('builds', {}), data.get('partial', False))
+
+    def get_hash(self, name):
+        record = self.files.get(name)
+        if (record is None):
+            return None
+        return record.get('hash')
+
+    def set(self, name, digest, **data):
+        '''
+        Record a file.
+        data
+            Extra data to record e.g. the pk of the object rendered.
+        '''
+        record = {'hash': digest, **data}
+        self.files[name] = record
+        self.changes[name] = record
+
+    def get_build(self, key):
+        return self.builds.get(key)
+
+    def set_build(self, key, stamp):
+        self.builds[key] = stamp
+        self.build_changes[key] = stamp
+
+    def remove(self, name):
+        self.files.pop(name, None)
+        self.changes[name] = None
+
+    def clear(self):
+        '''
+        Forget all records, including those on disk.
+        '''
+        self.files = {}
+        self.builds = {}
+        self.changes = {}
+        self.build_changes = {}
+        self.cleared = True
+
+    def update(self, changes):
+        '''
+        Apply changes from another manifest (e.g. from a worker
+        process) to this one.
+        '''
+        for name, record in changes.items():
+            if (record is None):
+                self.remove(name)
+            else:
+                self.files[name] = record
+                self.changes[name] = record
+
+    def save(self):
+        '''
+        Write changes to disk.
+        The file is replaced, not rewritten, so readers never see a
+        partial manifest.
+        '''
+        if (not(self.changes or self.build_changes or self.cleared)):
+            return
+        files, builds, _ = ({}, {}, False) if (self.cleared) else self.read()
+        for name, record in self.changes.items():
+            if (record is None):
+                files.pop(name, None)
+            else:
+                files[name] = record
+        builds.update(self.build_changes)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                data = {'files': files, 'builds': builds}
+                if (self.partial):
+                    data['partial'] = True
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.files = files
+        self.builds = builds
+        self.changes = {}
+        self.build_changes = {}
+        self.cleared = False
@@ -0,0 +1,581 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from static_models.manifest import content_hash
+from static_models.signals import page_written
+from static_models.writer import (
+    SIDECARS, COMPRESSORS, STREAM_COMPRESSORS, StagedFile, check_options, mkstemp
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Not POSIX. Only one process should write a pack at a time
+    fcntl = None
+
+
+# A pack is MAGIC, then records. A record is a HEADER, a name, then
+# data. Kind b'R' is a page. Kind b'I' is an index, with no name, and
+# is followed by a TRAILER. So the last index is found from the end
+# of the file. An index is full, of every page in the pack, or a
+# delta, of the pages added and removed since the index before.
+MAGIC = b'SMPACK2\n'
+TRAILER_MAGIC = b'SMPACKI2'
+
+# kind, length of name, length of data
+HEADER = struct.Struct('>cIQ')
+
+# TRAILER_MAGIC, then an IndexTail
+TRAILER = struct.Struct('>8sQQIQQ')
+
+# Most deltas after a full index. Bounds the reads to open a pack
+MAX_INDEX_DEPTH = 1024
+
+def get_pack_path():
+    '''
+    Path of the pack from the setting STATICVIEWS_PACK, or None.
+    '''
+    path = getattr(settings, 'STATICVIEWS_PACK', None)
+    return Path(path) if (path) else None
+
+def write_record(f, kind, name, length):
+    # Write a header and name. return offset of the data, to follow
+    name = name.encode('utf-8')
+    f.write(HEADER.pack(kind, len(name), length))
+    f.write(name)
+    return f.tell()
+
+def write_index(f, files, removed=(), tail=None):
+    '''
+    Write an index, and its trailer.
+    files
+        dict of name -> PackEntry.
+    removed
+        Names removed, for a delta.
+    tail
+        IndexTail of the index a delta follows. None for a full index.
+    return
+        IndexTail of the index written
+    '''
+    data = json.dumps({'files': files, 'removed': sorted(removed)}, separators=(',', ':')).encode('utf-8')
+    offset = f.tell()
+    write_record(f, b'I', '', len(data))
+    f.write(data)
+    if (tail is None):
+        new = IndexTail(offset, 0, 0, 0, len(files))
+    else:
+        new = IndexTail(offset, tail.offset, tail.depth + 1, tail.changed + len(files) + len(removed), tail.full_size)
+    f.write(TRAILER.pack(TRAILER_MAGIC, *new))
+    return new
+
+def read_tail(f, size):
+    '''
+    Read the trailer of the index ending at size.
+    return
+        IndexTail. None if there is no complete index there, because
+        an append is in progress, or was cut short.
+    '''
+    if (size < len(MAGIC) + TRAILER.size):
+        return None
+    f.seek(size - TRAILER.size)
+    magic, *fields = TRAILER.unpack(f.read(TRAILER.size))
+    if (magic != TRAILER_MAGIC):
+        return None
+    tail = IndexTail(*fields)
+    f.seek(tail.offset)
+    kind, n, length = HEADER.unpack(f.read(HEADER.size))
+    if ((kind != b'I') or (tail.offset + HEADER.size + n + length + TRAILER.size != size)):
+        return None
+    return tail
+
+def read_index_data(f, offset):
+    # return (data of the index record at offset, offset of its end)
+    f.seek(offset)
+    kind, n, length = HEADER.unpack(f.read(HEADER.size))
+    f.seek(offset + HEADER.size + n)
+    return (json.loads(f.read(length)), offset + HEADER.size + n + length + TRAILER.size)
+
+def read_index(f, size, known=None):
+    '''
+    Read the index of a pack. The last full index, with the deltas
+    after it applied.
+    f
+        Open file, or mmap, of the pack.
+    size
+        Size of the pack.
+    known
+        (IndexTail, index), as returned before, for the same pack. 
+        Only the deltas since are read.
+    return
+        (IndexTail, dict of name -> PackEntry). The tail is None if
+        the pack is empty. None if the pack does not end with an
+        index.
+    '''
+    if (size <= len(MAGIC)):
+        return (None, {})
+    tail = read_tail(f, size)
+    if (tail is None):
+        return None
+
+    # Back to a full index, or the index known
+    chain = []
+    t = tail
+    index = {}
+    while True:
+        if ((known is not None) and (known[0] is not None) and (t.offset == known[0].offset)):
+            index = dict(known[1])
+            break
+        chain.append(t)
+        if (t.depth == 0):
+            break
+        t = read_tail(f, read_index_data(f, t.prev)[1])
+        if (t is None):
+            raise ValueError('Pack index is broken')
+    for t in reversed(chain):
+        data = read_index_data(f, t.offset)[0]
+        for name in data['removed']:
+            index.pop(name, None)
+        index.update((k, PackEntry(*v)) for k, v in data['files'].items())
+    return (tail, index)
+
+def find_end(f, size):
+    '''
+    Walk the records of a pack.
+    return
+        offset of the end of the last complete index
+    '''
+    end = pos = len(MAGIC)
+    while (pos + HEADER.size <= size):
+        f.seek(pos)
+        kind, n, length = HEADER.unpack(f.read(HEADER.size))
+        pos += HEADER.size + n + length
+        if (kind == b'I'):
+            pos += TRAILER.size
+            if (pos <= size):
+                end = pos
+        elif (kind != b'R'):
+            break
+    return end
+
+def copy_range(src, dst, length, block_size=1024 * 1024):
+    # Copy length bytes from the position in src
+    while (length > 0):
+        data = src.read(min(block_size, length))
+        if (not(data)):
+            raise ValueError('Pack is shorter than its index')
+        dst.write(data)
+        length -= len(data)
+
+
+
+class IndexTail(namedtuple('IndexTail', ('offset', 'prev', 'depth', 'changed', 'full_size'))):
+    '''
+    Where an index is, and how far it is from a full index.
+    offset
+        Offset of the index record.
+    prev
+        Offset of the index before, for a delta. 0 if full.
+    depth
+        Deltas since the last full index. 0 if full.
+    changed
+        Pages changed by the deltas since the last full index.
+    full_size
+        Pages in the last full index.
+    '''
+    __slots__ = ()
+
+
+
+class PackEntry(namedtuple('PackEntry', ('offset', 'length', 'hash', 'mtime'))):
+    '''
+    Where a page is in a pack. Has 'st_size' and 'st_mtime', so can
+    stand in for a stat.
+    '''
+    __slots__ = ()
+
+    @property
+    def st_size(self):
+        return self.length
+
+    @property
+    def st_mtime(self):
+        return self.mtime
+
+
+
+class Pack():
+    '''
+    A pack file, of many pages.
+    Pages are only appended, each append ending with an index. Most
+    are deltas, of the pages in the append. When the deltas have
+    changed as many pages as the last full index holds, a new full
+    index is written. So index writes grow with the pages changed, not
+    with the pack. A page replaced or deleted leaves dead bytes, until
+    compact(). Appends are made under a lock, so processes can share a
+    pack.
+    path
+        Path of the pack.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @contextmanager
+    def locked(self):
+        '''
+        Context manager. Open the pack to append, locked. Made if
+        missing. An append cut short is trimmed off. Gives (file,
+        IndexTail of the last index, or None if empty), the file
+        positioned at the end.
+        '''
+        while True:
+            f = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666), 'r+b')
+            if (fcntl is not None):
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                same = (os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino)
+            except FileNotFoundError:
+                same = False
+            if (same):
+                break
+            # Compacted while waiting. Lock the new pack
+            f.close()
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if (size == 0):
+                f.write(MAGIC)
+                size = len(MAGIC)
+            elif (f.read(len(MAGIC)) != MAGIC):
+                raise ValueError(f'Not a pack file. path:"{self.path}"')
+            tail = read_tail(f, size)
+            if ((tail is None) and (size > len(MAGIC))):
+                size = find_end(f, size)
+                f.truncate(size)
+                tail = read_tail(f, size)
+            f.seek(0, os.SEEK_END)
+            yield (f, tail)
+
+    def append(self, segment, files, removed, fsync=False):
+        '''
+        Append pages, and an index.
+        segment
+            Open file of page records, as written by PackWriter.
+        files
+            dict of name -> PackEntry, new or changed. Offsets are into
+            the segment.
+        removed
+            Names to remove from the index.
+        '''
+        with self.locked() as (f, tail):
+            base = f.tell()
+            full = ((tail is None)
+                or (tail.depth >= MAX_INDEX_DEPTH)
+                or (tail.changed + len(files) + len(removed) >= tail.full_size)
+            )
+            if (full):
+                index = read_index(f, base)[1]
+                f.seek(base)
+            segment.seek(0)
+            shutil.copyfileobj(segment, f, 1024 * 1024)
+            files = {name: entry._replace(offset=entry.offset + base) for name, entry in files.items()}
+            if (full):
+                for name in removed:
+                    index.pop(name, None)
+                index.update(files)
+                write_index(f, index)
+            else:
+                write_index(f, files, removed, tail)
+            f.flush()
+            if (fsync):
+                os.fsync(f.fileno())
+
+    def stats(self):
+        '''
+        return
+            dict of 'pages', 'size' of the pack, and 'live', the bytes
+            of pages in the index.
+        '''
+        with self.locked() as (f, tail):
+            size = f.tell()
+            index = read_index(f, size)[1]
+            return {
+                'pages': len(index),
+                'size': size,
+                'live': sum(e.length for e in index.values()),
+            }
+
+    def compact(self):
+        '''
+        Rewrite the pack with only the pages in the index.
+        The new pack replaces the old by rename. Readers with the old
+        pack open keep reading it.
+        return
+            (size before, size after)
+        '''
+        with self.locked() as (f, tail):
+            before = f.tell()
+            index = read_index(f, before)[1]
+            fd, tmp = mkstemp(self.path.parent, '.' + self.path.name)
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(MAGIC)
+                    new = {}
+                    # In pack order, so reads are sequential
+                    for name, entry in sorted(index.items(), key=lambda i: i[1].offset):
+                        offset = write_record(out, b'R', name, entry.length)
+                        f.seek(entry.offset)
+                        copy_range(f, out, entry.length)
+                        new[name] = entry._replace(offset=offset)
+                    write_index(out, new)
+                    after = out.tell()
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        return (before, after)
+
+
+
+class PackWriter():
+    '''
+    Write pages into a pack, in place of files.
+    Has the interface of FileWriter, so a manager can use either.
+    Pages are written to a segment, a temporary file beside the pack.
+    On flush(), the segment, and an index, are appended to the pack in
+    one go. So readers never see part of a page, and processes only
+    hold the lock while appending.
+    path
+        Path of the pack.
+    root
+        Directory page paths are relative to. A page is named by its
+        relative path e.g. 'article/12345'.
+    fsync
+        As FileWriter. Anything but 'none' fsyncs the pack on flush().
+    compress
+        As FileWriter. Compressed copies are packed under the name with
+        '.gz' or '.br' added.
+    '''
+    def __init__(self, path, root, fsync='none', compress=()):
+        check_options(fsync, compress)
+        self.pack = Pack(path)
+        self.root = Path(root)
+        self.target = f'pack:{self.pack.path}'
+        self.fsync = fsync
+        self.compress = tuple(compress)
+        self.segment = None
+
+        # Changes since the last flush
+        self.files = {}
+        self.removed = set()
+
+    def name(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def get_segment(self):
+        if (self.segment is None):
+            self.segment = tempfile.TemporaryFile(dir=self.pack.path.parent)
+        return self.segment
+
+    def add(self, name, content):
+        offset = write_record(self.get_segment(), b'R', name, len(content))
+        self.segment.write(content)
+        self.files[name] = PackEntry(offset, len(content), content_hash(content), time.time())
+        self.removed.discard(name)
+
+    def add_file(self, name, staged):
+        # Add the content of a closed StagedFile
+        offset = write_record(self.get_segment(), b'R', name, staged.size)
+        with open(staged.tmp, 'rb') as fd:
+            shutil.copyfileobj(fd, self.segment, 1024 * 1024)
+        self.files[name] = PackEntry(offset, staged.size, staged.digest, time.time())
+        self.removed.discard(name)
+
+    def remove(self, name):
+        self.files.pop(name, None)
+        self.removed.add(name)
+
+    def write(self, content, path):
+        '''
+        Pack bytes under the name of a path.
+        '''
+        name = self.name(path)
+        self.add(name, content)
+        for encoding, suffix in SIDECARS.items():
+            if (encoding in self.compress):
+                self.add(name + suffix, COMPRESSORS[encoding](content))
+            else:
+                self.remove(name + suffix)
+        page_written.send(sender=self.__class__, path=path)
+
+    def stage(self, path):
+        '''
+        Start content for a path, to be written in chunks.
+        return
+            a StagedFile
+        '''
+        return StagedFile(path, dirpath=self.pack.path.parent)
+
+    def commit(self, staged):
+        '''
+        Pack a closed StagedFile, with compressed copies.
+        '''
+        name = self.name(staged.path)
+        try:
+            self.add_file(name, staged)
+            for encoding, suffix in SIDECARS.items():
+                if (encoding in self.compress):
+                    self.add_compressed(name + suffix, staged, encoding)
+                else:
+                    self.remove(name + suffix)
+        finally:
+            staged.discard()
+        page_written.send(sender=self.__class__, path=staged.path)
+
+    def add_compressed(self, name, src, encoding, chunk_size=65536):
+        c = STREAM_COMPRESSORS[encoding]()
+        staged = StagedFile(src.path, dirpath=self.pack.path.parent)
+        try:
+            with open(src.tmp, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(chunk_size), b''):
+                    staged.write(c.compress(chunk))
+            staged.write(c.flush())
+            staged.close()
+            self.add_file(name, staged)
+        finally:
+            staged.discard()
+
+    def stored_hash(self, path):
+        '''
+        Hash of the page in the pack, or None if missing.
+        '''
+        name = self.name(path)
+        entry = self.files.get(name)
+        if ((entry is None) and (name not in self.removed)):
+            found = get_reader(self.pack.path).get(name)
+            if (found is not None):
+                entry = found[0]
+        return entry.hash if (entry is not None) else None
+
+    def delete(self, path):
+        '''
+        Remove a page, and any compressed copies, from the pack.
+        '''
+        name = self.name(path)
+        self.remove(name)
+        for suffix in SIDECARS.values():
+            self.remove(name + suffix)
+        page_written.send(sender=self.__class__, path=path)
+
+    def flush(self):
+        '''
+        Append the pages written since the last flush to the pack.
+        '''
+        if (not(self.files) and not(self.removed)):
+            return
+        segment = self.get_segment()
+        segment.flush()
+        self.pack.append(segment, self.files, self.removed, fsync=(self.fsync != 'none'))
+        segment.close()
+        self.segment = None
+        self.files = {}
+        self.removed = set()
+
+    def close(self):
+        self.flush()
+
+
+
+class PackReader():
+    '''
+    Read pages from a pack, through a memory map.
+    The pack is checked for appends, or a compaction, at most every
+    check_interval seconds. Appends never change bytes already in the
+    pack, and a compaction makes a new file, so a map stays good for
+    as long as it is used.
+    path
+        Path of the pack.
+    check_interval
+        Seconds between checks of the pack.
+    '''
+    def __init__(self, path, check_interval=2.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+
+        # (map, index), replaced whole, so readers need no lock
+        self.state = (None, {})
+        self.tail = None
+        self.key = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.monotonic()
+        if ((self.checked is not None) and (now - self.checked < self.check_interval)):
+            return
+        with self.lock:
+            if ((self.checked is not None) and (now - self.checked < self.check_interval)):
+                return
+            self.checked = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self.state = (None, {})
+                self.tail = None
+                self.key = None
+                return
+            if ((st.st_ino, st.st_size) == self.key):
+                return
+            with open(self.path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_size == 0):
+                    return
+                m = mmap.mmap(f.fileno(), st.st_size, access=mmap.ACCESS_READ)
+            known = None
+            if ((self.key is not None) and (self.key[0] == st.st_ino)):
+                # Appended to. Only read the new indexes
+                known = (self.tail, self.state[1])
+            found = read_index(m, st.st_size, known)
+            if (found is None):
+                # An append in progress. Keep the old map, and look 
+                # again after the interval
+                return
+            self.tail, index = found
+            self.state = (m, index)
+            self.key = (st.st_ino, st.st_size)
+
+    def get(self, name):
+        '''
+        return
+            (PackEntry, memoryview of the page), or None if the page
+            is not in the pack.
+        '''
+        self.refresh()
+        m, index = self.state
+        entry = index.get(name)
+        if (entry is None):
+            return None
+        return (entry, memoryview(m)[entry.offset:entry.offset + entry.length])
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+def get_reader(path):
+    '''
+    Return a PackReader for a path, made once in a process.
+    '''
+    key = os.fspath(path)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if (reader is None):
+            reader = _readers[key] = PackReader(key)
+    return reader
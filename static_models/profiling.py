@@ -0,0 +1,281 @@
+import sys
+import json
+import heapq
+import itertools
+import cProfile
+import contextvars
+from time import perf_counter
+from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+# Phases of a page render, in order
+PHASES = ('context', 'render', 'hash', 'write')
+
+# Record of the page in progress, or None
+_current = contextvars.ContextVar('static_models_page', default=None)
+_connected = False
+
+def _count_query(execute, sql, params, many, context):
+    page = _current.get()
+    if (page is None):
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        page['queries'] += 1
+        page['query_time'] += perf_counter() - start
+
+def _add_wrapper(connection):
+    if (_count_query not in connection.execute_wrappers):
+        connection.execute_wrappers.append(_count_query)
+
+def _on_connection_created(sender, connection, **kwargs):
+    _add_wrapper(connection)
+
+def count_queries():
+    '''
+    Count queries on all connections, made now or later, in any
+    thread. The count goes to the page in progress, if any.
+    '''
+    global _connected
+    if (not(_connected)):
+        connection_created.connect(_on_connection_created, dispatch_uid='static_models_count_queries')
+        _connected = True
+    for connection in connections.all():
+        _add_wrapper(connection)
+
+
+
+def note(**data):
+    '''
+    Add data to the record of the page in progress, if any.
+    '''
+    page = _current.get()
+    if (page is not None):
+        page.update(data)
+
+
+
+class phase():
+    '''
+    Context manager. Add the time while active to a phase of the page
+    in progress. Does nothing if no page is in progress.
+    '''
+    __slots__ = ('name', 'page', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.page = _current.get()
+        if (self.page is not None):
+            self.start = perf_counter()
+
+    def __exit__(self, *args):
+        if (self.page is not None):
+            self.page[self.name] += perf_counter() - self.start
+
+
+
+class page():
+    '''
+    Context manager. Time a page, in phases, and count the queries
+    made while active. The record goes to the stats on exit.
+    '''
+    def __init__(self, stats, target, path):
+        self.stats = stats
+        self.record = {
+            'type': 'page',
+            'entry': stats.entry,
+            'target': str(target),
+            'path': str(path),
+            'total': 0.0,
+            **{k: 0.0 for k in PHASES},
+            'queries': 0,
+            'query_time': 0.0,
+            'bytes': 0,
+            'written': False,
+        }
+
+    def __enter__(self):
+        self.token = _current.set(self.record)
+        self.start = perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, *args):
+        self.record['total'] = perf_counter() - self.start
+        _current.reset(self.token)
+        if (exc_type is None):
+            self.stats.add(self.record)
+
+
+
+class BuildStats():
+    '''
+    Timings of the pages a manager renders.
+    Each page is written as a line of JSON as it finishes. Totals, and
+    the slowest pages, are kept for a summary.
+    entry
+        Name of the manager.
+    path
+        File to append lines to, or '-' for stdout.
+    top
+        Number of slowest pages to keep.
+    '''
+    def __init__(self, entry, path, top=10):
+        self.entry = entry
+        self.path = path
+        self.top = top
+        self.fd = None
+        self.reset()
+        count_queries()
+
+    def reset(self):
+        # Zero the totals, e.g. after a worker hands them to the parent
+        self.pages = 0
+        self.totals = {k: 0.0 for k in ('total', *PHASES, 'query_time')}
+        self.queries = 0
+        self.bytes = 0
+        self.written = 0
+
+        # heap of (total, n, record). n breaks ties
+        self.slowest = []
+        self.counter = itertools.count()
+
+    def page(self, target, path):
+        return page(self, target, path)
+
+    def emit(self, record):
+        # Line writes with O_APPEND do not interleave across processes
+        line = json.dumps(record, default=str) + '\n'
+        if (self.path == '-'):
+            sys.stdout.write(line)
+            return
+        if (self.fd is None):
+            self.fd = open(self.path, 'a', encoding='utf-8', buffering=1)
+        self.fd.write(line)
+
+    def add(self, record):
+        for k in self.totals:
+            self.totals[k] += record[k]
+        self.queries += record['queries']
+        self.bytes += record['bytes']
+        self.written += record['written']
+        self.pages += 1
+        self.keep(record)
+        self.emit(record)
+
+    def keep(self, record):
+        item = (record['total'], next(self.counter), record)
+        if (len(self.slowest) < self.top):
+            heapq.heappush(self.slowest, item)
+        elif (item[0] > self.slowest[0][0]):
+            heapq.heapreplace(self.slowest, item)
+
+    def state(self):
+        '''
+        Totals and slowest pages, for a parent process to merge.
+        '''
+        return {
+            'pages': self.pages,
+            'totals': self.totals,
+            'queries': self.queries,
+            'bytes': self.bytes,
+            'written': self.written,
+            'slowest': [r for _, _, r in self.slowest],
+        }
+
+    def merge(self, state):
+        for k, v in state['totals'].items():
+            self.totals[k] += v
+        self.queries += state['queries']
+        self.bytes += state['bytes']
+        self.written += state['written']
+        self.pages += state['pages']
+        for record in state['slowest']:
+            self.keep(record)
+
+    def summary(self, seconds=None):
+        '''
+        Write a summary line for the entry, and return it.
+        seconds
+            Wall time of the build, if known.
+        '''
+        record = {
+            'type': 'entry',
+            'entry': self.entry,
+            'pages': self.pages,
+            'written': self.written,
+            'bytes': self.bytes,
+            'queries': self.queries,
+            'seconds': seconds,
+            **{k: round(v, 6) for k, v in self.totals.items()},
+            'slowest': [
+                {'target': r['target'], 'path': r['path'], 'total': r['total'], 'queries': r['queries']}
+                for _, _, r in sorted(self.slowest, key=lambda i: i[0], reverse=True)
+            ],
+        }
+        self.emit(record)
+        return record
+
+    def close(self):
+        if (self.fd is not None):
+            self.fd.close()
+            self.fd = None
+        if (self.path == '-'):
+            # A worker process may not flush on exit
+            sys.stdout.flush()
+
+
+
+class Profiler():
+    '''
+    Context manager. Profile the code while active, then save the
+    profile to a directory.
+    'cprofile' saves '<name>.prof', for pstats or snakeviz.
+    'pyinstrument' saves '<name>.html', and needs the 'pyinstrument'
+    package.
+    dirpath
+        Directory to save to. Made if missing.
+    name
+        Name for the file.
+    '''
+    def __init__(self, dirpath, name, profiler='cprofile'):
+        if (profiler not in PROFILERS):
+            raise ImproperlyConfigured(f'Unknown profiler. Must be one of {PROFILERS}. value:"{profiler}"')
+        if ((profiler == 'pyinstrument') and (pyinstrument is None)):
+            raise ImproperlyConfigured('Profiler "pyinstrument" requires the "pyinstrument" package')
+        self.dirpath = Path(dirpath)
+        self.name = ''.join(c if (c.isalnum() or c in '._-') else '_' for c in name)
+        self.profiler = profiler
+
+    def __enter__(self):
+        if (self.profiler == 'cprofile'):
+            self.p = cProfile.Profile()
+            self.p.enable()
+        else:
+            self.p = pyinstrument.Profiler()
+            self.p.start()
+        return self
+
+    def __exit__(self, *args):
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        if (self.profiler == 'cprofile'):
+            self.p.disable()
+            self.path = self.dirpath / (self.name + '.prof')
+            self.p.dump_stats(self.path)
+        else:
+            self.p.stop()
+            self.path = self.dirpath / (self.name + '.html')
+            self.path.write_text(self.p.output_html(), encoding='utf-8')
@@ -0,0 +1,139 @@
+import os
+import shutil
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+
+
+def get_releases_path():
+    '''
+    Path of the directory holding releases.
+    From the setting STATICVIEWS_RELEASES, or beside STATICVIEWS_DIR,
+    e.g. 'site.releases'.
+    '''
+    path = getattr(settings, 'STATICVIEWS_RELEASES', None)
+    if (path is None):
+        base = Path(settings.STATICVIEWS_DIR)
+        path = base.with_name(base.name + '.releases')
+    return Path(path)
+
+def get_releases():
+    return Releases(settings.STATICVIEWS_DIR, get_releases_path())
+
+def link_tree(src, dst):
+    '''
+    Make dst a copy of the tree src, with files hard-linked, not
+    copied.
+    Generated files are replaced on write, never rewritten, so a
+    write into dst does not change src. If the trees are on different
+    filesystems, files are copied.
+    '''
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = Path(dst) / Path(dirpath).relative_to(src)
+        target.mkdir(exist_ok=True)
+        for name in filenames:
+            try:
+                os.link(Path(dirpath) / name, target / name)
+            except OSError:
+                shutil.copy2(Path(dirpath) / name, target / name)
+
+
+
+class Releases():
+    '''
+    Versions of the generated site, one directory each, with a symlink
+    to the current version.
+    The link is STATICVIEWS_DIR, so servers, and StaticView, read the
+    current version without knowing about the others. A new version
+    starts as a hard-linked copy of the current one, is built, then
+    the link is swapped. The swap is a rename, so atomic. Readers see
+    the old site or the new, never a mix.
+    link
+        Path of the symlink.
+    path
+        Directory holding the versions.
+    '''
+    def __init__(self, link, path):
+        self.link = Path(link)
+        self.path = Path(path)
+
+    def versions(self):
+        '''
+        Names of versions, oldest first.
+        '''
+        if (not(self.path.is_dir())):
+            return []
+        return sorted(p.name for p in self.path.iterdir() if (p.is_dir()))
+
+    def current(self):
+        '''
+        Name of the current version, or None.
+        '''
+        if (not(self.link.is_symlink())):
+            return None
+        return Path(os.readlink(self.link)).name
+
+    def new_name(self):
+        # Sortable, and unique enough for builds
+        return timezone.now().strftime('%Y%m%dT%H%M%S%f')
+
+    def adopt(self):
+        '''
+        If the link is a plain directory, from builds before releases,
+        move it in as the first version.
+        The directory is missing between the move and the link, for
+        the time of two syscalls, once.
+        '''
+        if (self.link.is_dir() and not(self.link.is_symlink())):
+            self.path.mkdir(parents=True, exist_ok=True)
+            name = self.new_name()
+            os.rename(self.link, self.path / name)
+            self.switch(name)
+
+    def new(self):
+        '''
+        Make a version to build into, seeded from the current one.
+        return
+            Path of the version
+        '''
+        self.adopt()
+        self.path.mkdir(parents=True, exist_ok=True)
+        dst = self.path / self.new_name()
+        current = self.current()
+        if (current is None):
+            dst.mkdir()
+        else:
+            link_tree(self.path / current, dst)
+        return dst
+
+    def switch(self, name):
+        '''
+        Make a version current.
+        '''
+        if (not((self.path / name).is_dir())):
+            raise ValueError(f"No release named '{name}'")
+        target = os.path.relpath(self.path / name, self.link.parent)
+        tmp = self.link.with_name(f'.{self.link.name}.{os.getpid()}.tmp')
+        tmp.unlink(missing_ok=True)
+        os.symlink(target, tmp)
+        os.replace(tmp, self.link)
+
+    def discard(self, path):
+        '''
+        Delete a version, e.g. after a failed build.
+        '''
+        shutil.rmtree(path, ignore_errors=True)
+
+    def prune(self, keep):
+        '''
+        Delete all versions but the current, and the newest 'keep' of 
+        the others.
+        return
+            names deleted
+        '''
+        current = self.current()
+        others = [name for name in self.versions() if (name != current)]
+        doomed = others[:-keep] if (keep > 0) else others
+        for name in doomed:
+            self.discard(self.path / name)
+        return doomed
@@ -1,4 +1,5 @@
 import os
+from urllib.parse import quote
 from django.http.response import FileResponse
 from django.core.exceptions import ImproperlyConfigured
 
@@ -10,11 +11,13 @@ class AssuredFileResponse(FileResponse):
     respose has been told it is, as content_type. No guesses. So you
     would have to set, for example 'application/gzip' for zipped files.
     """
-    def __init__(self, *args, content_type=None, **kwargs):
+    def __init__(self, *args, content_type=None, content_length=None, **kwargs):
         if content_type is None:
             raise ImproperlyConfigured(
                 "AssuredFileResponse requires an attribute 'content_type'"
                 " passed in initial parameters")
+        # If known, saves a stat() of the file
+        self.content_length = content_length
         super().__init__(*args, content_type=content_type, **kwargs)
 
     def set_headers(self, filelike):
@@ -29,7 +32,9 @@ class AssuredFileResponse(FileResponse):
         # }
         filename = getattr(filelike, 'name', None)
         filename = filename if (isinstance(filename, str) and filename) else self.filename
-        if os.path.isabs(filename):
+        if self.content_length is not None:
+            self['Content-Length'] = self.content_length
+        elif os.path.isabs(filename):
             self['Content-Length'] = os.path.getsize(filelike.name)
         elif hasattr(filelike, 'getbuffer'):
             self['Content-Length'] = filelike.getbuffer().nbytes
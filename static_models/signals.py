@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
+
+
+# Sent when a generated file is written or deleted.
+# Arguments: path, a pathlib.Path of the file
+page_written = Signal()
+
+
+def enqueue_save(sender, instance, created=False, **kwargs):
+    '''
+    Receiver for post_save. Queue the object for regeneration.
+    '''
+    from static_models.jobqueue import get_queue
+    label = sender._meta.label_lower
+    pk = instance.pk
+    # A new object may appear on pages which never loaded it e.g.
+    # lists. The worker needs to know.
+    action = 'create' if (created) else 'save'
+    # Not until the change is visible to the worker
+    transaction.on_commit(lambda: get_queue().put(label, pk, action))
+
+def enqueue_delete(sender, instance, **kwargs):
+    '''
+    Receiver for post_delete. Queue the object's files for deletion.
+    '''
+    from static_models.jobqueue import get_queue
+    label = sender._meta.label_lower
+    pk = instance.pk
+    transaction.on_commit(lambda: get_queue().put(label, pk, 'delete'))
+
+def register(model):
+    '''
+    Queue saves and deletes of a model, for regeneration by the
+    'viewstaticqueue' command.
+    '''
+    post_save.connect(enqueue_save, sender=model, dispatch_uid=f'static_models_save_{model._meta.label_lower}')
+    post_delete.connect(enqueue_delete, sender=model, dispatch_uid=f'static_models_delete_{model._meta.label_lower}')
+
+def autoregister():
+    '''
+    Register the models of all STATIC_VIEWS entries with a query.
+    '''
+    from static_models.view_generator import get_view
+    for vs in getattr(settings, 'STATIC_VIEWS', []):
+        if (vs.get('view') and vs.get('query')):
+            View = get_view(vs['view']) if isinstance(vs['view'], str) else vs['view']
+            register(View.model)
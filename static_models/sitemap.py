@@ -0,0 +1,111 @@
+import json
+from pathlib import Path
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from static_models.layout import strip_fanout
+from static_models.manifest import Manifest, content_hash
+from static_models.writer import gzip_compress
+
+
+# Most URLs in one sitemap file, from the sitemaps protocol
+SITEMAP_LIMIT = 50000
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+def get_site_url():
+    '''
+    The setting STATICVIEWS_URL, the absolute URL STATICVIEWS_DIR is
+    served at, ending with '/'.
+    '''
+    url = getattr(settings, 'STATICVIEWS_URL', None)
+    if (not(url) or ('://' not in url)):
+        raise ImproperlyConfigured("Sitemaps require a setting STATICVIEWS_URL, an absolute URL e.g. 'https://example.com/'")
+    return url if url.endswith('/') else url + '/'
+
+def site_pages(basepath, dirpaths, fanouts=None):
+    '''
+    Pages recorded in the manifests of directories.
+    From the records the build made, so nothing is queried or read.
+    dirpaths
+        Directories holding manifests, under basepath.
+    fanouts
+        dict of entry name -> fanout depth, for entries with fanout.
+        Their pages are at the paths they are served from, without the
+        fanout directories.
+    return
+        list of dicts of 'path', from basepath, 'hash', and 'lastmod',
+        in order of path
+    '''
+    basepath = Path(basepath)
+    fanouts = fanouts or {}
+    pages = {}
+    for dirpath in set(Path(d) for d in dirpaths):
+        m = Manifest(dirpath)
+        prefix = dirpath.relative_to(basepath).as_posix()
+        for name, record in m.files.items():
+            depth = fanouts.get(record.get('entry'))
+            if (depth):
+                name = strip_fanout(name, depth)
+            path = name if (prefix == '.') else f'{prefix}/{name}'
+            pages[path] = {
+                'path': path,
+                'hash': record['hash'],
+                # Records from before times were kept have the build
+                'lastmod': record.get('modified') or m.get_build(record.get('entry')),
+            }
+    return [pages[k] for k in sorted(pages)]
+
+def urlset(site_url, pages):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<urlset xmlns="{SITEMAP_NS}">']
+    for page in pages:
+        lastmod = f"<lastmod>{page['lastmod']}</lastmod>" if (page['lastmod']) else ''
+        lines.append(f"<url><loc>{escape(site_url + quote(page['path']))}</loc>{lastmod}</url>")
+    lines.append('</urlset>\n')
+    return '\n'.join(lines).encode('utf-8')
+
+def sitemap_index(site_url, names):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<sitemapindex xmlns="{SITEMAP_NS}">']
+    for name in names:
+        lines.append(f'<sitemap><loc>{escape(site_url + quote(name))}</loc></sitemap>')
+    lines.append('</sitemapindex>\n')
+    return '\n'.join(lines).encode('utf-8')
+
+def put(writer, path, content):
+    # Write, unless stored and unchanged
+    if (writer.stored_hash(path) == content_hash(content)):
+        return False
+    writer.write(content, path)
+    return True
+
+def write_sitemaps(writer, basepath, pages, site_url, limit=SITEMAP_LIMIT):
+    '''
+    Write sitemaps of pages, gzipped, 'limit' URLs to a file e.g.
+    'sitemap-1.xml.gz', and an index of them, 'sitemap.xml'. Files
+    from an earlier, larger, site are deleted.
+    writer
+        A FileWriter, or other writer, as a manager uses.
+    pages
+        As site_pages().
+    return
+        count of sitemap files, not counting the index
+    '''
+    basepath = Path(basepath)
+    names = []
+    for i in range(0, len(pages), limit):
+        name = f'sitemap-{len(names) + 1}.xml.gz'
+        put(writer, basepath / name, gzip_compress(urlset(site_url, pages[i:i + limit])))
+        names.append(name)
+    put(writer, basepath / 'sitemap.xml', sitemap_index(site_url, names))
+    n = len(names) + 1
+    while (writer.stored_hash(basepath / f'sitemap-{n}.xml.gz') is not None):
+        writer.delete(basepath / f'sitemap-{n}.xml.gz')
+        n += 1
+    return len(names)
+
+def write_page_index(writer, basepath, pages, name='pages.json'):
+    '''
+    Write a JSON index of pages, as site_pages().
+    '''
+    content = json.dumps({'pages': pages}, separators=(',', ':')).encode('utf-8')
+    put(writer, Path(basepath) / name, content)
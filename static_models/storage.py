@@ -0,0 +1,146 @@
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import InvalidStorageError, Storage, storages
+from static_models.manifest import new_hash
+from static_models.signals import page_written
+from static_models.writer import (
+    SIDECARS, COMPRESSORS, STREAM_COMPRESSORS, FileWriter, StagedFile
+)
+
+
+def get_storage_setting():
+    '''
+    The setting STATICVIEWS_STORAGE, or None.
+    '''
+    return getattr(settings, 'STATICVIEWS_STORAGE', None)
+
+def get_storage(storage):
+    '''
+    Return a Storage.
+    storage
+        An alias in the STORAGES setting, or a Storage.
+    '''
+    if (isinstance(storage, Storage)):
+        return storage
+    try:
+        return storages[storage]
+    except InvalidStorageError:
+        raise ImproperlyConfigured(f'A storage must be an alias in STORAGES, or a Storage. value:"{storage}"')
+
+
+
+class StorageWriter(FileWriter):
+    '''
+    Write pages to a Django Storage e.g. S3, in place of files.
+    Has the interface of FileWriter, so a manager can use either.
+    Uploads are made by a pool of threads. Django's S3 storages keep a
+    connection per thread, so the pool is a pool of connections too.
+    A storage which will not overwrite has the old file deleted first.
+    storage
+        An alias in the STORAGES setting, or a Storage.
+    root
+        Directory page paths are relative to. A page is saved under its
+        relative path e.g. 'article/12345'.
+    threads
+        Threads to upload with. If 0, upload in the calling thread.
+        Default is 8.
+    compress
+        As FileWriter. Compressed copies are saved under the name with
+        '.gz' or '.br' added. Copies in encodings not given are
+        deleted, as they would be served in place of the new page.
+    '''
+    def __init__(self, storage, root, threads=8, compress=()):
+        super().__init__('none', threads, compress)
+        self.storage = get_storage(storage)
+        self.root = Path(root)
+        if (isinstance(storage, str)):
+            self.target = f'storage:{storage}'
+        else:
+            cls = self.storage.__class__
+            self.target = f'storage:{cls.__module__}.{cls.__qualname__}'
+
+    def name(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def put(self, name, content):
+        # content is a Django File
+        if (self.storage.get_available_name(name) != name):
+            # Would be saved under another name
+            self.storage.delete(name)
+        self.storage.save(name, content)
+
+    def _write(self, content, path):
+        name = self.name(path)
+        for encoding, suffix in SIDECARS.items():
+            if (encoding in self.compress):
+                self.put(name + suffix, ContentFile(COMPRESSORS[encoding](content)))
+            else:
+                # Storages ignore deletes of missing names
+                self.storage.delete(name + suffix)
+        self.put(name, ContentFile(content))
+        page_written.send(sender=self.__class__, path=path)
+
+    def stage(self, path):
+        '''
+        Start content for a path, to be written in chunks.
+        return
+            a StagedFile, in the temporary directory
+        '''
+        return StagedFile(path, dirpath=tempfile.gettempdir())
+
+    def _commit(self, staged):
+        name = self.name(staged.path)
+        try:
+            for encoding, suffix in SIDECARS.items():
+                if (encoding in self.compress):
+                    self.put_compressed(name + suffix, staged, encoding)
+                else:
+                    self.storage.delete(name + suffix)
+            with open(staged.tmp, 'rb') as fd:
+                self.put(name, File(fd))
+        finally:
+            staged.discard()
+        page_written.send(sender=self.__class__, path=staged.path)
+
+    def put_compressed(self, name, src, encoding, chunk_size=65536):
+        c = STREAM_COMPRESSORS[encoding]()
+        staged = StagedFile(src.path, dirpath=tempfile.gettempdir())
+        try:
+            with open(src.tmp, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(chunk_size), b''):
+                    staged.write(c.compress(chunk))
+            staged.write(c.flush())
+            staged.close()
+            with open(staged.tmp, 'rb') as fd:
+                self.put(name, File(fd))
+        finally:
+            staged.discard()
+
+    def delete(self, path):
+        '''
+        Delete a page, and any compressed copies, from the storage.
+        '''
+        name = self.name(path)
+        self.storage.delete(name)
+        for suffix in SIDECARS.values():
+            self.storage.delete(name + suffix)
+        page_written.send(sender=self.__class__, path=path)
+
+    def stored_hash(self, path, chunk_size=65536):
+        '''
+        Hash of the page in the storage, or None if missing.
+        The page is read, so this is for pages with no manifest
+        record.
+        '''
+        name = self.name(path)
+        if (not(self.storage.exists(name))):
+            return None
+        h = new_hash()
+        with self.storage.open(name, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                h.update(chunk)
+        return h.hexdigest()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+from django.test import SimpleTestCase
+from static_models.pack import (
+    MAGIC, HEADER, Pack, PackWriter, PackReader, read_index, read_tail
+)
+
+
+# ./manage.py test static_models.tests.test_pack
+class TestPack(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.path = self.root / 'site.pack'
+        self.writer = PackWriter(self.path, self.root)
+
+        # name -> content, as the pack should hold
+        self.expected = {}
+
+    def put(self, *names, content=None):
+        # Write pages, then append them
+        for name in names:
+            data = content or f'page {name}'.encode('utf-8')
+            self.writer.write(data, self.root / name)
+            self.expected[name] = data
+        self.writer.flush()
+
+    def remove(self, *names):
+        for name in names:
+            self.writer.delete(self.root / name)
+            self.expected.pop(name, None)
+        self.writer.flush()
+
+    def read(self):
+        # return (IndexTail, index), read cold from the pack
+        with open(self.path, 'rb') as f:
+            return read_index(f, os.fstat(f.fileno()).st_size)
+
+    def assertPackHolds(self, expected):
+        reader = PackReader(self.path, check_interval=0)
+        index = self.read()[1]
+        self.assertEqual(set(index), set(expected))
+        for name, data in expected.items():
+            entry, view = reader.get(name)
+            self.assertEqual(bytes(view), data)
+            self.assertEqual(entry.length, len(data))
+
+    def test_append_then_read(self):
+        self.put('article/one', 'article/two')
+        tail, index = self.read()
+        self.assertEqual(tail.depth, 0)
+        self.assertEqual(tail.full_size, 2)
+        self.assertPackHolds(self.expected)
+
+        self.put('article/one', content=b'changed')
+        self.remove('article/two')
+        self.assertPackHolds(self.expected)
+        self.assertIsNone(PackReader(self.path, check_interval=0).get('article/two'))
+
+    def test_delta_chain_rolls_over_to_full(self):
+        names = [f'article/{i}' for i in range(10)]
+        self.put(*names)
+        self.assertEqual(self.read()[0].full_size, 10)
+
+        # Deltas until they have changed as many pages as the full
+        # index holds. Without compression, a write also removes the
+        # compressed copies, so changes three names
+        reader = PackReader(self.path, check_interval=0)
+        reader.get(names[0])
+        depths = []
+        for i in range(12):
+            self.put(names[i % 10], content=f'version {i}'.encode('utf-8'))
+            tail, index = self.read()
+            depths.append(tail.depth)
+
+            # A reader folding in the new deltas agrees with a cold read
+            reader.get(names[0])
+            self.assertEqual(reader.tail, tail)
+            self.assertEqual(reader.state[1], index)
+        self.assertEqual(depths, [1, 2, 3, 0, 1, 2, 3, 0, 1, 2, 3, 0])
+        self.assertPackHolds(self.expected)
+
+    def test_delta_chain_rolls_over_at_max_depth(self):
+        self.put(*[f'article/{i}' for i in range(100)])
+        with mock.patch('static_models.pack.MAX_INDEX_DEPTH', 3):
+            depths = []
+            for i in range(5):
+                self.put('article/0', content=f'version {i}'.encode('utf-8'))
+                depths.append(self.read()[0].depth)
+        self.assertEqual(depths, [1, 2, 3, 0, 1])
+        self.assertPackHolds(self.expected)
+
+    def test_recovers_from_cut_append(self):
+        self.put('article/one', 'article/two')
+        self.put('article/three')
+        good = os.path.getsize(self.path)
+
+        # An append which stopped inside its index, as by a crash
+        self.put('article/four')
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 5)
+        self.expected.pop('article/four')
+        self.assertIsNone(self.read())
+
+        # The next append trims the cut append off first
+        with Pack(self.path).locked() as (f, tail):
+            self.assertEqual(f.tell(), good)
+            self.assertIsNotNone(tail)
+        self.assertEqual(os.path.getsize(self.path), good)
+        self.put('article/five')
+        self.assertPackHolds(self.expected)
+
+    def test_compact_keeps_live_pages(self):
+        self.put('article/one', 'article/two', 'article/three')
+        self.put('article/one', content=b'replaced')
+        self.put('article/two', content=b'replaced again' * 100)
+        self.remove('article/three')
+        pack = Pack(self.path)
+        before, after = pack.compact()
+        self.assertLess(after, before)
+        self.assertEqual(os.path.getsize(self.path), after)
+        self.assertPackHolds(self.expected)
+
+        # Only the live pages are left, then one full index
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(len(MAGIC)), MAGIC)
+            names = []
+            while True:
+                kind, n, length = HEADER.unpack(f.read(HEADER.size))
+                if (kind != b'R'):
+                    break
+                names.append(f.read(n).decode('utf-8'))
+                f.seek(length, os.SEEK_CUR)
+            self.assertEqual(kind, b'I')
+            self.assertEqual(read_tail(f, after).depth, 0)
+        self.assertEqual(sorted(names), sorted(self.expected))
+        stats = pack.stats()
+        self.assertEqual(stats['pages'], 2)
+        self.assertEqual(stats['live'], sum(len(d) for d in self.expected.values()))
@@ -1,114 +1,42 @@
-import os
 import re
 import pathlib
+import asyncio
+import time
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+from django.apps import apps
 from django.conf import settings
+from django.db import connections
 from django.http.request import HttpRequest, QueryDict
-from django.core.files.base import ContentFile
+from django.template import engines, TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates
+from django.template.loader import select_template
+from django.template.loaders.cached import Loader as CachedLoader
 from django.db import models
+from django.db.models import Q
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import module_loading
+from django.utils import timezone
+from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
-
-
-from django.core.handlers.wsgi import WSGIRequest
-from io import BytesIO
-from urllib.parse import unquote_to_bytes, urljoin, urlparse, urlsplit
-from django.utils.encoding import force_bytes
-from django.utils.http import urlencode
-from django.core.servers.basehttp  import get_internal_wsgi_application
+from static_models.client import get_client, get_async_client
+from static_models.dependencies import get_index, record
+from static_models.manifest import (
+    Manifest, content_hash, shard_manifest_name, in_shard
+)
+from static_models.profiling import BuildStats, Profiler, phase, note
+from static_models.writer import FileWriter
+from static_models.pack import PackWriter, get_pack_path
+from static_models.storage import StorageWriter, get_storage_setting
+from static_models.layout import check_fanout, fanout_path
 
 
     
                     
-class RequestFactory:
-    # Build a mocked up request
-    # hacked out of django.test.clients
-    def __init__(self):
-        #self.json_encoder = json_encoder
-        #self.defaults = defaults
-        #self.cookies = SimpleCookie()
-        self.errors = BytesIO()
-        
-    def _base_environ(self, **request):
-        """
-        The base environment for a request.
-        """
-        # This is a minimal valid WSGI environ dictionary, plus:
-        # - HTTP_COOKIE: for cookie support,
-        # - REMOTE_ADDR: often useful, see #8551.
-        # See https://www.python.org/dev/peps/pep-3333/#environ-variables
-        return {
-            'HTTP_COOKIE': '',
-            'PATH_INFO': '/',
-            'REMOTE_ADDR': '127.0.0.1',
-            'REQUEST_METHOD': 'GET',
-            'SCRIPT_NAME': '',
-            # Pretend on localhost, like the development it is
-            'SERVER_NAME': 'localhost',
-            'SERVER_PORT': '80',
-            'SERVER_PROTOCOL': 'HTTP/1.1',
-            'wsgi.version': (1, 0),
-            'wsgi.url_scheme': 'http',
-            #'wsgi.input': FakePayload(b''),
-            'wsgi.input':            BytesIO(),
-            'wsgi.errors': self.errors,
-            'wsgi.multiprocess': True,
-            'wsgi.multithread': False,
-            'wsgi.run_once': False,
-            #**self.defaults,
-            **request,
-        }
-
-    def request(self, **request):
-        "Construct a generic request object."
-        return WSGIRequest(self._base_environ(**request))
-
-    def generic(self, method, path, data='',
-                content_type='application/octet-stream', secure=False,
-                **extra):
-        """Construct an arbitrary HTTP request."""
-        parsed = urlparse(str(path))  # path can be lazy
-        data = force_bytes(data, settings.DEFAULT_CHARSET)
-        r = {
-            'PATH_INFO': self._get_path(parsed),
-            'REQUEST_METHOD': method,
-            'SERVER_PORT': '443' if secure else '80',
-            'wsgi.url_scheme': 'https' if secure else 'http',
-        }
-        # if data:
-            # r.update({
-                # 'CONTENT_LENGTH': str(len(data)),
-                # 'CONTENT_TYPE': content_type,
-                # 'wsgi.input': FakePayload(data),
-            # })
-        ##r.update(extra)
-        # If QUERY_STRING is absent or empty, we want to extract it from the URL.
-        if not r.get('QUERY_STRING'):
-            # WSGI requires latin-1 encoded strings. See get_path_info().
-            query_string = parsed[4].encode().decode('iso-8859-1')
-            r['QUERY_STRING'] = query_string
-        return self.request(**r)
-
-    def _get_path(self, parsed):
-        path = parsed.path
-        # If there are parameters, add them
-        if parsed.params:
-            path += ";" + parsed.params
-        path = unquote_to_bytes(path)
-        # Replace the behavior where non-ASCII values in the WSGI environ are
-        # arbitrarily decoded with ISO-8859-1.
-        # Refs comment in `get_bytes_from_wsgi()`.
-        return path.decode('iso-8859-1')
-
-    def get(self, path, data=None, secure=False, **extra):
-        """Construct a GET request."""
-        data = {} if data is None else data
-        return self.generic('GET', path, secure=secure, **{
-            'QUERY_STRING': urlencode(data, doseq=True),
-            **extra,
-        })
-       
 def get_view(viewname):
     '''
     Return a view class.
@@ -122,6 +50,208 @@ def get_view(viewname):
     return view
 
 
+# Keys of a STATIC_VIEWS entry, with defaults. Each is passed to the
+# ViewStaticManager parameter of the same name.
+VIEWSETTING_DEFAULTS = {
+    'view': None,
+    'query': None,
+    'urls': [],
+    'filename': None,
+    'filename_from_attribute': 'pk',
+    'filepath': None,
+    'name': None,
+    'modified_field': None,
+    'chunk_size': 2000,
+    'select_related': None,
+    'prefetch_related': None,
+    'only': None,
+    'track_dependencies': False,
+    'fanout': None,
+    'fanout_depth': 2,
+    'compress': (),
+}
+
+def normalize_viewsetting(vs):
+    '''
+    Fill missing keys of a STATIC_VIEWS entry with defaults.
+    '''
+    for k, v in VIEWSETTING_DEFAULTS.items():
+        if (not(k in vs)):
+            vs[k] = v
+    return vs
+
+def manager_from_setting(vs, compress=None, **kwargs):
+    '''
+    Return a ViewStaticManager for a normalised STATIC_VIEWS entry.
+    compress
+        Overrides the entry 'compress', if not None e.g. given on the
+        command line.
+    kwargs
+        Options not in the entry e.g. overwrite, extension.
+    '''
+    options = {k: vs[k] for k in VIEWSETTING_DEFAULTS}
+    if (compress is not None):
+        options['compress'] = compress
+    return ViewStaticManager(**options, **kwargs)
+    
+def entry_filepath(vs, basepath):
+    '''
+    Directory a normalised STATIC_VIEWS entry generates into, as its
+    manager would make it.
+    '''
+    view = vs['view']
+    if isinstance(view, str): 
+        view = get_view(view)
+    return ViewStaticManager.get_filepath(Path(basepath), vs['filepath'], view)
+
+def entry_name(vs, basepath=None):
+    '''
+    Name of the manager of a normalised STATIC_VIEWS entry, as the
+    manager would make it.
+    '''
+    if (vs['name']):
+        return vs['name']
+    basepath = Path(basepath or settings.STATICVIEWS_DIR)
+    view = vs['view']
+    if isinstance(view, str): 
+        view = get_view(view)
+    return ViewStaticManager.default_name(view, entry_filepath(vs, basepath), basepath)
+
+def plan_entry(vs, basepath=None, incremental=False, shard=None, filters=None, since=None):
+    '''
+    What a manager of a normalised STATIC_VIEWS entry would render, 
+    as ViewStaticManager.plan(). No manager is made, so nothing is
+    written, opened, or set up. Only the manifest and database are 
+    read.
+    return
+        list of targets. pks for a query, URLs for URLs, or '' for
+        a one-off page
+    '''
+    shard = tuple(shard) if (shard) else None
+    if (vs['urls']):
+        return [k for k in vs['urls'] if ((shard is None) or in_shard(k, *shard))]
+    if (vs['query']):
+        basepath = Path(basepath or settings.STATICVIEWS_DIR)
+        view = vs['view']
+        if isinstance(view, str): 
+            view = get_view(view)
+        last_build = None
+        if (incremental):
+            m = Manifest(entry_filepath(vs, basepath))
+            last_build = ViewStaticManager.build_time(m, entry_name(vs, basepath))
+        qs = narrow_queryset(
+            query_queryset(view.model, vs['query']),
+            vs['modified_field'],
+            last_build,
+            since,
+            filters or []
+        )[0]
+        return [pk for pk in qs.values_list('pk', flat=True) if ((shard is None) or in_shard(pk, *shard))]
+    if ((shard is None) or (shard[0] == 1)):
+        return ['']
+    return []
+
+def query_queryset(model, query):
+    '''
+    Return a queryset of a model, narrowed by the 'query' of a 
+    STATIC_VIEWS entry.
+    '''
+    qs = model.objects.all()
+    if (isinstance(query, Q)):
+        qs = qs.filter(query)
+    elif (isinstance(query, dict)):
+        qs = qs.filter(**query)
+    elif (query != 'all'):
+        raise ImproperlyConfigured(f'A "query" must be "all", a dict of lookups, or a Q object. query:{query!r}')
+    return qs
+
+def narrow_queryset(qs, modified_field, last_build=None, since=None, filters=()):
+    '''
+    Narrow a queryset to objects changed since the last build, if
+    given, then objects changed since 'since', and the filters.
+    return
+        (queryset, True if narrowed)
+    '''
+    narrowed = False
+    if (modified_field and last_build):
+        qs = qs.filter(**{modified_field + '__gt': last_build})
+        narrowed = True
+    if (since):
+        qs = qs.filter(**{modified_field + '__gt': since})
+        narrowed = True
+    for f in filters:
+        qs = qs.filter(f) if (isinstance(f, Q)) else qs.filter(**f)
+        narrowed = True
+    return (qs, narrowed)
+
+def get_writer(basepath, fsync='none', write_threads=0, compress=(), pack=None, storage=None):
+    '''
+    Return a writer for generated pages. To a pack, or a storage, if
+    given or set, or to files.
+    '''
+    pack = pack or get_pack_path()
+    storage = storage or get_storage_setting()
+    if (pack and storage):
+        raise ImproperlyConfigured('Pages can be written to a pack, or a storage, not both')
+    if (pack):
+        return PackWriter(pack, basepath, fsync, compress)
+    if (storage):
+        return StorageWriter(storage, basepath, write_threads or 8, compress)
+    return FileWriter(fsync, write_threads, compress)
+
+def use_cached_loaders():
+    '''
+    Make Django template engines cache compiled templates.
+    Django caches unless 'loaders' are set by hand, often to reload 
+    templates in development. A build renders the same templates 
+    thousands of times, so wrap the loaders in the cached loader.
+    '''
+    for backend in engines.all():
+        if (isinstance(backend, DjangoTemplates)):
+            engine = backend.engine
+            if (not(any(isinstance(loader, CachedLoader) for loader in engine.template_loaders))):
+                engine.loaders = [('django.template.loaders.cached.Loader', engine.loaders)]
+                # A cached_property, so drop it to rebuild
+                engine.__dict__.pop('template_loaders', None)
+
+def _chunks(items, size):
+    # Split a list into lists of length size (the last may be shorter)
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+# The manager of a pool process, made by _worker_init()
+_worker_manager = None
+
+def _worker_init(config):
+    # Runs once in each pool process. A forked process inherits the
+    # parent setup, a spawned process needs its own. Either way, DB
+    # connections are opened fresh by the worker on first query.
+    # The manager is rebuilt from the parent config once, so the 
+    # manifest is read once, not once a chunk.
+    global _worker_manager
+    if (not apps.ready):
+        django.setup()
+    _worker_manager = ViewStaticManager(**config)
+
+def _render_chunk(method, chunk):
+    # Runs in a pool process. Render this chunk of pks or URLs.
+    g = _worker_manager
+    g.manifest.changes = {}
+    g.produced = set()
+    count = getattr(g, method)(chunk)
+    g.writer.flush()
+    if (g.deps is not None):
+        g.deps.commit()
+    
+    stats = None
+    if (g.stats is not None):
+        stats = g.stats.state()
+        g.stats.close()
+        g.stats.reset()
+    
+    # The parent saves the manifest, so return changes. The parent also
+    # needs every file produced, to sync, and stats to summarise
+    return (count, g.manifest.changes, g.produced, stats)
+
                     
 class ViewStaticManager():
     '''
@@ -137,7 +267,8 @@ class ViewStaticManager():
         Must be at least a DetailView. Either a string path or the View 
         class (but not an instance).
     query
-        For a model. Currently, only 'all' is accepted. 
+        For a model. 'all', a dict of field lookups e.g. 
+        {'published': True}, or a Q object. 
     urls
         List of IRLs to evoke the View.
     filename
@@ -152,11 +283,126 @@ class ViewStaticManager():
         in which case it defaults to a modelname and opetional 
         viewname.
     overwrite
-        overwrite existing generated files, even if same size. Default 
+        overwrite existing generated files, even if unchanged. Default 
         is False.
     extension
         Optional extension name. Dot is added automatically.
+    workers
+        Number of processes to render with. If more than one, the pks
+        of a query, or the URLs, are split into chunks and rendered by
+        a process pool. Default is 1, render in this process.
+    name
+        Identifies the manager in the manifest. Default is made from 
+        the view and filepath.
+    modified_field
+        For use on models. A field holding the time an object was last
+        changed e.g. a DateTimeField with 'auto_now'. Used by 
+        incremental builds. 
+    incremental
+        Only render objects changed since the last build, and delete 
+        the files of objects that no longer exist. Objects are only 
+        filtered if a 'modified_field' is given. Default is False.
+    sync
+        After a build, delete files this manager recorded in the 
+        manifest on an earlier build, but did not produce on this one
+        e.g. files of objects removed from the query, or of URLs 
+        removed from settings. Files are deleted after new files are in
+        place, so the site is never missing pages. Default is False.
+    chunk_size
+        Objects fetched from the database at a time. Objects are not
+        cached, so memory use depends on this, not the size of the 
+        query. Default is 2000.
+    select_related
+        For use on models. List of fields passed to the queryset 
+        select_related(). Use for foreign keys the template touches.
+    prefetch_related
+        For use on models. List of lookups passed to the queryset 
+        prefetch_related(). Prefetches are made per chunk.
+    only
+        For use on models. List of fields passed to the queryset 
+        only(). Should include any fields the template, filename or
+        modified_field use, or they will be fetched one by one.
+    fsync
+        When to fsync written files. 'none', 'file', or 'batch' (once
+        per file and directory, when the manager is done). Default is
+        'none'.
+    write_threads
+        If more than 0, files are written by a pool of threads, so 
+        rendering does not wait on the disk. Default is 0.
+    compress
+        List of encodings, 'gzip' and/or 'br'. Compressed copies of 
+        files are written alongside e.g. 'page.gz'. Default is none.
+    track_dependencies
+        Record the model objects loaded while rendering each page, in
+        a dependency index. Then a change to, say, an author can 
+        regenerate the pages that show the author. Default is False.
+    async_urls
+        Render URLs through Django's ASGI handler, on an event loop. 
+        Async views, or views waiting on I/O, then render concurrently.
+        Default is False.
+    concurrency
+        With async_urls, the most URLs in progress at once. Default 
+        is 10.
+    basepath
+        Directory to generate into, in place of STATICVIEWS_DIR e.g. a
+        new release. Default is STATICVIEWS_DIR.
+    shard
+        (shard, count), numbered from 1 e.g. (2, 4). Render only the 
+        pks or URLs in this shard, so a build can be spread across 
+        machines sharing the output. Each shard saves a manifest of its
+        own. Deleting files is left to merge_shards(). Default is None,
+        render everything.
+    stats
+        Path of a file to append timings to, as lines of JSON, or '-' 
+        for stdout. A line is written for each page, with the time 
+        spent building the context, rendering, hashing, and writing, 
+        and the count of queries. A summary line, with the slowest 
+        pages, is written for each build. Default is None, no timings.
+    stats_top
+        With stats, how many of the slowest pages are summarised. 
+        Default is 10.
+    filters
+        List of filters to narrow the query by, for this build only.
+        Each a dict of field lookups, or a Q object. A filtered build 
+        does not sync. Default is None.
+    since
+        A datetime. Only render objects changed since, by the 
+        'modified_field'. Default is None.
+    profile
+        Directory to save a profile of each build to. Only the 
+        process calling create() is profiled, so use with one worker.
+        Default is None, no profile.
+    profiler
+        'cprofile' or 'pyinstrument'. Default is 'cprofile'.
+    fanout
+        Spread files of objects and URLs across subdirectories, so no
+        one directory holds millions. 'hash' for directories from a 
+        hash of the filename e.g. '3f/a0/12345', 'prefix' for 
+        directories from the start of it e.g. '12/34/12345'. StaticView
+        must be given the same. Default is None, all files in one 
+        directory.
+    fanout_depth
+        Levels of fanout directories. Each level is two characters, so
+        with 'hash' 256 directories. Default is 2.
+    pack
+        Path of a pack file to write pages into, in place of files. 
+        Pages are named in the pack by their path from basepath. 
+        Default is the setting STATICVIEWS_PACK, or None, write 
+        files.
+    storage
+        A Django Storage, or its alias in the STORAGES setting, to 
+        save pages to, in place of files e.g. S3. Pages are named by 
+        their path from basepath. Uploads are made by 'write_threads' 
+        threads, or 8 if not set. Default is the setting 
+        STATICVIEWS_STORAGE, or None, write files.
+    cache_templates
+        Wrap the template loaders of the process in the cached loader,
+        as use_cached_loaders(). For build processes. A web process
+        would stop reloading changed templates. Default is False.
     '''
+    # Pks or URLs sent to a worker process in one go
+    parallel_chunk_size = 500
+    
     #! reorder
     def __init__(self, 
         view = None,
@@ -167,12 +413,43 @@ class ViewStaticManager():
         filepath = None,
         overwrite = False,
         extension = '',
+        workers = 1,
+        name = None,
+        modified_field = None,
+        incremental = False,
+        sync = False,
+        chunk_size = 2000,
+        select_related = None,
+        prefetch_related = None,
+        only = None,
+        fsync = 'none',
+        write_threads = 0,
+        compress = (),
+        async_urls = False,
+        concurrency = 10,
+        track_dependencies = False,
+        basepath = None,
+        shard = None,
+        filters = None,
+        since = None,
+        stats = None,
+        stats_top = 10,
+        profile = None,
+        profiler = 'cprofile',
+        fanout = None,
+        fanout_depth = 2,
+        pack = None,
+        storage = None,
+        cache_templates = False,
     ):
+        # Kept so worker processes can build a duplicate manager
+        self.config = {k: v for k, v in locals().items() if (k != 'self')}
+        
         if isinstance(view, str): 
             view = get_view(view)
         self.View = view
 
-        self.basepath = Path(settings.STATICVIEWS_DIR)
+        self.basepath = Path(basepath or settings.STATICVIEWS_DIR)
 
         # decide a path from the configured dir to this view output
         self.filepath = self.get_filepath(
@@ -184,6 +461,11 @@ class ViewStaticManager():
         # make the destination dirs
         self.filepath.mkdir(exist_ok=True)
         
+        # hashes of generated files, to tell if they changed
+        self.manifest = Manifest(self.filepath)
+        self.writer = get_writer(self.basepath, fsync, write_threads, compress, pack, storage)
+        self.deps = get_index() if (track_dependencies) else None
+        
         # set extension
         if (extension):
             extension = '.' + extension        
@@ -192,21 +474,82 @@ class ViewStaticManager():
         self.query = query
         self.urls = urls
         if (urls):
-            # If there are URLs to process, start an internal server.
-            # This server is like the one run by ''runserver'
-            # Radically this is a BaseHandler, set with the local 
-            # environment. AFAIK, it needs no closure. Also, errors
-            # it throws are natural and good as they read.
-            self.server = get_internal_wsgi_application()
+            # If there are URLs to process, get the internal client.
+            # It is made once in a process, then shared by managers.
+            if (async_urls):
+                self.client = get_async_client()
+            else:
+                self.client = get_client()
+        self.async_urls = async_urls
+        self.concurrency = concurrency
         
         self.overwrite = overwrite
+        self.workers = max(1, workers)
+        self.modified_field = modified_field
+        self.incremental = incremental
+        self.sync = sync
+        self.shard = tuple(shard) if (shard) else None
+        self.filters = filters or []
+        if (since and not(modified_field)):
+            raise ImproperlyConfigured('Rendering objects changed since a time requires a "modified_field"')
+        self.since = since
+        self.chunk_size = chunk_size
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+        self.only = only
         self.filename = filename
         self.filename_from_attribute = filename_from_attribute
         self.id_fieldname = filename_from_attribute
+        self.name = name or self.default_name(self.View, self.filepath, self.basepath)
+        check_fanout(fanout, fanout_depth)
+        self.fanout = fanout
+        self.fanout_depth = fanout_depth
+
+        # Rendering is offline, so one generic request, and one view of
+        # each class, serve every page
+        self.request = self.mk_request()
+        self.views = {}
+        if (cache_templates):
+            use_cached_loaders()
+        self.stats = BuildStats(self.name, stats, stats_top) if (stats) else None
+        self.profile = profile
+        self.profiler = profiler
+        
+        # Files deleted by an incremental build, or sync
+        self.delete_count = 0
+
+        # Manifest names of files produced, written or not
+        self.produced = set()
+
+        # Recorded for files written, for sitemaps
+        self.modified = timezone.now().isoformat(timespec='seconds')
+
+        # True if a build rendered only some of the targets
+        self.partial = False
+
+    def reset(self):
+        '''
+        Make ready for another build, as if new. For managers kept
+        warm, as other processes may have written since the last.
+        '''
+        self.manifest = Manifest(self.filepath)
+        self.produced = set()
+        self.partial = False
+        self.delete_count = 0
+        self.modified = timezone.now().isoformat(timespec='seconds')
 
+    @staticmethod
+    def default_name(View, filepath, basepath):
+        # A name to key this manager in the manifest
+        if (View is None):
+            name = 'urls'
+        else:
+            name = f'{View.__module__}.{View.__qualname__}'
+        return f'{name}:{filepath.relative_to(basepath).as_posix()}'
 
                     
-    def get_filepath(self, basedirpath, filepath, view):
+    @classmethod
+    def get_filepath(cls, basedirpath, filepath, view):
         '''
         return 
         The path if given. If not, and a view model exists, use the 
@@ -215,11 +558,51 @@ class ViewStaticManager():
         ''' 
         if ((filepath is None) and hasattr(view, 'model')):
             modelname = view.model._meta.model_name
-            filepath = self.camelcase_to_underscore(modelname)
+            filepath = cls.camelcase_to_underscore(modelname)
         if (filepath is None):
             filepath = ''
         return basedirpath / filepath
 
+    def recording(self, *objs):
+        '''
+        Context manager. If tracking dependencies, collect the model
+        objects loaded while active. Gives the set, or None.
+        objs
+            Objects already loaded.
+        '''
+        if (self.deps is None):
+            return nullcontext()
+        return record(*objs)
+
+    def timing(self, target, full_filepath):
+        '''
+        Context manager. If collecting stats, time a page.
+        '''
+        if (self.stats is None):
+            return nullcontext()
+        return self.stats.page(target, full_filepath)
+
+    def timed(self, name):
+        '''
+        Context manager. If collecting stats, time a phase of the page
+        in progress e.g. 'render'.
+        '''
+        if (self.stats is None):
+            return nullcontext()
+        return phase(name)
+
+    def profiling(self):
+        '''
+        Context manager. If a profile directory is set, profile.
+        '''
+        if (self.profile is None):
+            return nullcontext()
+        return Profiler(self.profile, self.name, self.profiler)
+
+    def set_dependencies(self, target, touched):
+        if (self.deps is not None):
+            self.deps.set(self.name, target, touched)
+            
     def mk_request(self, url=''):
         request = HttpRequest()
         
@@ -232,6 +615,37 @@ class ViewStaticManager():
         request.method = 'GET'
         return request         
         
+    def view_for(self, View):
+        '''
+        Return an instance of a view class, made once then reused.
+        The view is set up with the manager request.
+        '''
+        view = self.views.get(View)
+        if (view is None):
+            view = View()
+            view.setup(self.request)
+            self.views[View] = view
+        return view
+
+    def warm_templates(self):
+        '''
+        Load the view templates into the template cache, before
+        rendering. Worker processes forked after inherit them.
+        Not all views can name templates without an object, so this
+        does what it can.
+        '''
+        if (self.View is None):
+            return
+        view = self.view_for(self.View)
+        if (not(hasattr(view, 'get_template_names'))):
+            return
+        if (not(hasattr(view, 'object'))):
+            view.object = None
+        try:
+            select_template(view.get_template_names())
+        except (AttributeError, ImproperlyConfigured, TemplateDoesNotExist):
+            pass
+
     @property
     def location(self):
         '''
@@ -243,7 +657,8 @@ class ViewStaticManager():
         '''
         return self.filepath.relative_to(self.basepath.parent)
                 
-    def camelcase_to_underscore(self, s):
+    @staticmethod
+    def camelcase_to_underscore(s):
         # A utility for generating a filename from view classes
         # Lifted from someplace in Django?
         # https://djangosnippets.org/snippets/585/
@@ -258,21 +673,22 @@ class ViewStaticManager():
         full_filepath = self.filepath / (filename + self.extension)
         
         # make a view
-        view = View()
-
-        # can be a boring generic request for now.
-        view.request = self.mk_request()
+        view = self.view_for(View)
 
-        # get a context
-        # nearly all views have a context, but the base doesn't. So...
-        ctx = {}
-        if (hasattr(view, 'get_context_data')):
-            ctx = view.get_context_data()
+        with self.timing('', full_filepath):
+            with self.recording() as touched:
+                # get a context
+                # nearly all views have a context, but the base doesn't. So...
+                ctx = {}
+                if (hasattr(view, 'get_context_data')):
+                    with self.timed('context'):
+                        ctx = view.get_context_data()
 
-        # get and render response
-        count = 0
-        response = view.render_to_response(ctx)        
-        r = self.render(response, full_filepath)
+                # get and render response
+                count = 0
+                response = view.render_to_response(ctx)        
+                r = self.render(response, full_filepath)
+            self.set_dependencies('', touched)
         if(r):
             count = 1
         return count
@@ -303,154 +719,639 @@ class ViewStaticManager():
             raise ImproperlyConfigured(f'Cannot construct an identifier from given URL. name:"{url}"')
         return fid
 
-    # At some point, angling for this to be the method for view-writing 
-    # also
-    def writeContent(self, content, full_filepath):
-        isfile = full_filepath.is_file()         
-        size = 0
-        if(isfile):
-            size = os.path.getsize(full_filepath)
-        generated_size = len(content)
-        if ((generated_size != size) or self.overwrite):
-            with open(full_filepath, 'wb') as fd:  
-                fd.write(content) 
-            return full_filepath
-        return None
+    def manifest_name(self, full_filepath):
+        # Files are recorded relative to the manifest
+        return full_filepath.relative_to(self.filepath).as_posix()
         
-    def create_from_url(self, url_filename):
+    def record_data(self, pk=None):
+        # Data for the manifest record of a page
+        data = {'entry': self.name}
+        if (pk is not None):
+            data['pk'] = str(pk)
+        if (self.writer.target is not None):
+            data['target'] = self.writer.target
+        return data
+
+    def is_unchanged(self, name, digest, full_filepath, data):
+        '''
+        Is the file the same as the content with this digest?
+        Asks the manifest. If the manifest has no record, the file may
+        predate the manifest, so the file itself is hashed. A file
+        recorded as written somewhere else, e.g. as files before a
+        pack was set, is changed.
+        data
+            Data for the manifest record. Updated if the record is 
+            missing or stale.
+        '''
+        file_record = self.manifest.files.get(name)
+        if (file_record is None):
+            stored = self.writer.stored_hash(full_filepath)
+            if (stored is None):
+                return False
+            file_record = {'hash': stored, **data}
+        if (file_record.get('target') != data.get('target')):
+            return False
+        unchanged = (file_record['hash'] == digest)
+        if (unchanged and any(file_record.get(k) != v for k, v in data.items())):
+            # Keep the rest e.g. the time last modified
+            kept = {k: v for k, v in file_record.items() if (k != 'hash')}
+            self.manifest.set(name, digest, **{**kept, **data})
+        return unchanged
+        
+    def writeContent(self, content, full_filepath, pk=None):
+        '''
+        Write content to a file
+        only if the content has changed, or overwrite is set.
+        pk
+            pk of the object rendered, if any. Recorded in the manifest.
+        return
+            the filepath if written, else None
+        '''
+        name = self.manifest_name(full_filepath)
+        self.produced.add(name)
+        with self.timed('hash'):
+            digest = content_hash(content)
+        data = self.record_data(pk)
+        if (not(self.overwrite) and self.is_unchanged(name, digest, full_filepath, data)):
+            return None
+        # With write threads, this is only the time to hand over
+        with self.timed('write'):
+            self.writer.write(content, full_filepath)
+        self.record_written(name, digest, data)
+        if (self.stats is not None):
+            note(bytes=len(content), written=True)
+        return full_filepath
+
+    def record_written(self, name, digest, data):
+        # The time modified only moves if the content changed, so an
+        # overwrite does not touch it
+        file_record = self.manifest.files.get(name)
+        modified = self.modified
+        if ((file_record is not None) and (file_record['hash'] == digest)):
+            modified = file_record.get('modified', modified)
+        self.manifest.set(name, digest, modified=modified, **data)
+
+    def write_chunks(self, chunks, full_filepath, pk=None):
+        '''
+        As writeContent(), for content in chunks, e.g. from a 
+        streaming response. Chunks are written to a temporary file as
+        they come, and hashed on the way, so the content is never 
+        held whole.
+        '''
+        return self.write_staged(self.stage_chunks(chunks, full_filepath), pk)
+
+    def stage_chunks(self, chunks, full_filepath):
+        # return a closed StagedFile of the chunks
+        staged = self.writer.stage(full_filepath)
+        try:
+            with self.timed('write'):
+                for chunk in chunks:
+                    staged.write(chunk)
+                staged.close()
+        except BaseException:
+            staged.discard()
+            raise
+        return staged
+
+    def write_staged(self, staged, pk=None):
+        '''
+        Put a closed StagedFile in place
+        only if the content has changed, or overwrite is set.
+        return
+            the filepath if written, else None
+        '''
+        full_filepath = staged.path
+        name = self.manifest_name(full_filepath)
+        self.produced.add(name)
+        data = self.record_data(pk)
+        if (not(self.overwrite) and self.is_unchanged(name, staged.digest, full_filepath, data)):
+            staged.discard()
+            return None
+        with self.timed('write'):
+            self.writer.commit(staged)
+        self.record_written(name, staged.digest, data)
+        if (self.stats is not None):
+            note(bytes=staged.size, written=True)
+        return full_filepath
+
+    def write_response(self, response, full_filepath, pk=None):
+        '''
+        Write the content of a rendered response. A streaming
+        response is written as it streams.
+        '''
+        if (getattr(response, 'is_async', False)):
+            # An async view's stream, reached from sync code
+            return async_to_sync(self.write_response_async)(response, full_filepath, pk)
+        if (response.streaming):
+            return self.write_chunks(response.streaming_content, full_filepath, pk)
+        return self.writeContent(response.content, full_filepath, pk)
+
+    async def write_response_async(self, response, full_filepath, pk=None):
+        # As write_response(), but can take an async stream
+        if (not(response.streaming)):
+            return self.writeContent(response.content, full_filepath, pk)
+        if (not(getattr(response, 'is_async', False))):
+            # A sync stream may query the database, which can not be
+            # done on the event loop. So it is read in a thread
+            staged = await sync_to_async(self.stage_chunks)(response.streaming_content, full_filepath)
+            return self.write_staged(staged, pk)
+        staged = self.writer.stage(full_filepath)
+        try:
+            with self.timed('write'):
+                async for chunk in response.streaming_content:
+                    staged.write(chunk)
+                staged.close()
+        except BaseException:
+            staged.discard()
+            raise
+        return self.write_staged(staged, pk)
+        
+    def url_target(self, url_filename):
+        '''
+        return
+            (url, full_filepath). The URL is normalised. 
+        '''
         url = url_filename[0]
         fid = url_filename[1]
         if (fid is None):
             fid = self.filename_from_url(url)
             
         # make the full filepath
-        full_filepath = self.filepath / (fid + self.extension)
+        full_filepath = self.target_filepath(fid)
 
         # Only request a rough filepath in settings. So a very basic
         # normalisation that the filepath is absolute to site base 
         if (url[0] != '/'):
             url = '/' + url
-            
-        # Generate a mock request
+        return (url, full_filepath)
+        
+    def create_from_url(self, url_filename):
+        url, full_filepath = self.url_target(url_filename)
+
         # Needs to be a different level of handling because the only 
         # data is a URL, no object to root out context etc.
-        # So go high, ask a test server
-        rf = RequestFactory()
-        wsgiRequest = rf.get(url)
-
-        # For a response, run through the server
-        httpResponse = self.server.get_response(wsgiRequest)
+        # So go high, ask the internal client
+        with self.timing(url_filename[0], full_filepath):
+            # The view builds the context and renders, together
+            with self.recording() as touched, self.timed('render'):
+                httpResponse = self.client.get(url)
+            self.set_dependencies(url_filename[0], touched)
         
-        # get content and write to file
-        content = httpResponse.content
-        return self.writeContent(content, full_filepath)
+            # get content and write to file
+            return self.write_response(httpResponse, full_filepath)
 
+    def render_parallel(self, method, chunks):
+        '''
+        Render chunks of work across a pool of processes.
+        method
+            Name of the manager method a worker calls on each chunk.
+        chunks
+            List of arguments for that method.
+        return
+            Sum of the counts returned by the workers.
+        '''
+        config = dict(self.config, workers=1)
+
+        # DB connections must not be shared across a fork. Close them 
+        # here, parent and children will reopen their own.
+        connections.close_all()
+        if (self.deps is not None):
+            self.deps.close()
+        count = 0
+        with ProcessPoolExecutor(
+            max_workers=self.workers, 
+            initializer=_worker_init,
+            initargs=(config,)
+        ) as pool:
+            for r, changes, produced, stats in pool.map(_render_chunk, repeat(method), chunks):
+                count += r
+                self.manifest.update(changes)
+                self.produced.update(produced)
+                if (stats is not None):
+                    self.stats.merge(stats)
+        return count
+
+    def get_parallel_chunk_size(self, length):
+        # Aim for a few chunks per worker, so a slow chunk does not 
+        # hold up the others, but cap the size. 
+        size = -(-length // (self.workers * 4))
+        return max(1, min(size, self.parallel_chunk_size))
+        
     def render_urls(self, urls):
+        if ((self.workers > 1) and (len(urls) > 1)):
+            items = list(urls.items())
+            chunks = [dict(c) for c in _chunks(items, self.get_parallel_chunk_size(len(items)))]
+            return self.render_parallel('render_urls', chunks)
+            
+        targets = [(key, *self.url_target(url_filename)) for key, url_filename in zip(urls, urls.items())]
+        if (self.async_urls):
+            return asyncio.run(self.render_targets_async(targets))
+        responses = self.client.get_many([url for _, url, _ in targets])
         count = 0
-        for url_filename in urls.items():
-            r = self.create_from_url(url_filename)
+        for key, url, full_filepath in targets:
+            # The response is made on next(), so inside the recording
+            with self.timing(key, full_filepath):
+                with self.recording() as touched, self.timed('render'):
+                    httpResponse = next(responses)
+                self.set_dependencies(key, touched)
+                r = self.write_response(httpResponse, full_filepath)
             if (r):
                 count += 1 
         return count
 
+    def get_since(self):
+        '''
+        Time of the last build of this manager, or None.
+        '''
+        return self.build_time(self.manifest, self.name)
+
+    @staticmethod
+    def build_time(manifest, name):
+        stamp = manifest.get_build(name)
+        if (stamp is None):
+            return None
+        return datetime.fromisoformat(stamp)
+        
+    def get_queryset(self, view, query=None):
+        '''
+        Return a queryset of all objects to render from.
+        Has the query, and the configured related/only options applied.
+        query
+            Default is the manager query.
+        '''
+        if (query is None):
+            query = self.query
+        qs = query_queryset(view.model, query)
+        if (self.select_related):
+            qs = qs.select_related(*self.select_related)
+        if (self.prefetch_related):
+            qs = qs.prefetch_related(*self.prefetch_related)
+        if (self.only):
+            qs = qs.only(*self.only)
+        return qs
+        
+    async def render_targets_async(self, targets):
+        '''
+        Render (key, url, full_filepath) targets concurrently.
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def render(key, url, full_filepath):
+            # Each task has its own context, so its own recording and
+            # timing
+            with self.timing(key, full_filepath):
+                async with semaphore:
+                    with self.recording() as touched, self.timed('render'):
+                        httpResponse = await self.client.get(url)
+                self.set_dependencies(key, touched)
+                # Hashing is quick, and writes can be given to threads
+                return await self.write_response_async(httpResponse, full_filepath)
+        results = await asyncio.gather(*(render(*t) for t in targets))
+        return sum(1 for r in results if r)
+        
+    def filter_queryset(self, qs):
+        '''
+        Narrow a queryset to the objects this build renders. If
+        incremental, objects changed since the last build. Then 
+        objects changed since 'since', and the filters. 
+        Sets partial if narrowed.
+        '''
+        last_build = self.get_since() if (self.incremental) else None
+        qs, narrowed = narrow_queryset(qs, self.modified_field, last_build, self.since, self.filters)
+        if (narrowed):
+            self.partial = True
+        return qs
+
     def render_query_set(self, View, query='all'):
-        view = View()
-        if (query == 'all'):
-            qs = view.model.objects.all()
-        else:
-            qs = view.model.objects.filter(query)
+        view = self.view_for(View)
+        qs = self.get_queryset(view, query)
+        if (self.incremental and (self.shard is None)):
+            # Shards leave deletes to the merge
+            self.delete_count = self.delete_vanished(qs)
+        qs = self.filter_queryset(qs)
             
+        if ((self.workers > 1) or self.shard):
+            pks = [pk for pk in qs.values_list('pk', flat=True) if self.in_shard(pk)]
+            if (self.workers > 1):
+                chunks = _chunks(pks, self.get_parallel_chunk_size(len(pks)))
+                return self.render_parallel('render_pks', chunks)
+            return sum(self.render_pks(chunk) for chunk in _chunks(pks, self.chunk_size))
+        return self.render_objects(view, qs)
+
+    def in_shard(self, key):
+        return (self.shard is None) or in_shard(key, *self.shard)
+
+    def render_pks(self, pks):
+        '''
+        Render the objects with the given pks.
+        '''
+        view = self.view_for(self.View)
+        qs = self.get_queryset(view).filter(pk__in=pks)
+        return self.render_objects(view, qs)
+        
+    def delete_vanished(self, qs):
+        '''
+        Delete files rendered from objects no longer in the queryset.
+        Found from the pks recorded in the manifest.
+        return
+            count of files deleted
+        '''
+        live = set(str(pk) for pk in qs.values_list('pk', flat=True))
+        return self.delete_recorded(lambda name, r: ('pk' in r) and (r['pk'] not in live))
+
+    def delete_orphans(self):
+        '''
+        Delete files recorded by this manager, but not produced since
+        it was made.
+        Only good after a full build.
+        return
+            count of files deleted
+        '''
+        return self.delete_recorded(lambda name, r: name not in self.produced)
+
+    def delete_recorded(self, test):
+        '''
+        Delete files recorded in the manifest by this manager.
+        test
+            Callable given the manifest name and record. Delete if True.
+        return
+            count of files deleted
+        '''
+        count = 0
+        for name, file_record in list(self.manifest.files.items()):
+            if ((file_record.get('entry') == self.name) and test(name, file_record)):
+                self.writer.delete(self.filepath / name)
+                self.prune_dirs(self.filepath / name)
+                self.manifest.remove(name)
+                if ((self.deps is not None) and ('pk' in file_record)):
+                    self.deps.remove(self.name, file_record['pk'])
+                count += 1
+        return count
+        
+    def prune_dirs(self, full_filepath):
+        # Remove directories left empty by a delete e.g. fanout 
+        # directories. Never the manager directory
+        d = full_filepath.parent
+        while (d != self.filepath):
+            try:
+                d.rmdir()
+            except OSError:
+                # Not empty, or gone
+                break
+            d = d.parent
+
+    def render_objects(self, view, qs):
         count = 0
-        for obj in qs: 
+        # iterator() does not cache the objects, so memory stays flat.
+        # With a chunk_size, prefetches are made per chunk 
+        for obj in qs.iterator(chunk_size=self.chunk_size): 
             r = self.create_from_obj(view, obj)
             if (r):
                 count += 1 
         return count
                 
-    def create_from_obj(self, view, obj):
+    def obj_filepath(self, obj):
         fid = getattr(obj, self.filename_from_attribute) 
         if callable(fid):
             fid = fid()
         
         # NB: fid may come through as numeric e.g. 'pk'
-        full_filepath = self.filepath / (str(fid) + self.extension)
-        view.object = obj
+        return self.target_filepath(str(fid))
 
-        # can be a boring generic request for now.
-        view.request = self.mk_request()
-        ctx = view.get_context_data()
-        response = view.render_to_response(ctx)
-        return self.render(response, full_filepath)
-        
-    def render(self, response, full_filepath):
+    def target_filepath(self, fid):
         '''
-        Resder the response o a file
-        only if sizes match, or override is set.
+        Path of the file for an object or URL, with the extension, 
+        in any fanout directories.
         '''
-        isfile = full_filepath.is_file() 
+        return self.filepath / fanout_path(fid + self.extension, self.fanout, self.fanout_depth)
+
+    def create_from_obj(self, view, obj):
+        full_filepath = self.obj_filepath(obj)
+        view.object = obj
+        with self.timing(obj.pk, full_filepath):
+            with self.recording(obj) as touched:
+                with self.timed('context'):
+                    ctx = view.get_context_data()
+                if (self.modified_field):
+                    # For fragment caches e.g. 
+                    # {% cache 3600 body object.pk object_version %}
+                    ctx.setdefault('object_version', str(getattr(obj, self.modified_field)))
+                response = view.render_to_response(ctx)
+                r = self.render(response, full_filepath, obj.pk)
+            self.set_dependencies(obj.pk, touched)
+        return r
         
-        size = 0
-        if(isfile):
-            size = os.path.getsize(full_filepath)
+    def render(self, response, full_filepath, pk=None):
+        '''
+        Render the response to a file
+        only if the content has changed, or overwrite is set.
+        '''
+        # Response only caches data, resolve. A view may return a
+        # streaming response, which has nothing to resolve
+        if (hasattr(response, 'render')):
+            with self.timed('render'):
+                response = response.render()
+        return self.write_response(response, full_filepath, pk)
+
+    def plan(self):
+        '''
+        What create() would render, without rendering.
+        return
+            list of targets. pks for a query, URLs for URLs, or '' for
+            a one-off page
+        '''
+        if (self.urls):
+            return [k for k in self.urls if self.in_shard(k)]
+        if (self.query):
+            qs = self.filter_queryset(self.get_queryset(self.view_for(self.View)))
+            return [pk for pk in qs.values_list('pk', flat=True) if self.in_shard(pk)]
+        if ((self.shard is None) or (self.shard[0] == 1)):
+            return ['']
+        return []
+
+    def create(self):
+        # Taken before rendering, so objects changed during the build
+        # are caught by the next one
+        started = timezone.now()
+        start = time.perf_counter()
+        with self.profiling():
+            self.warm_templates()
+            if (self.urls):
+                count = self.render_urls({k: v for k, v in self.urls.items() if self.in_shard(k)})
+            elif (self.query):
+                count = self.render_query_set(self.View, self.query)
+            elif ((self.shard is None) or (self.shard[0] == 1)):
+                count = self.render_no_input(self.View, self.filename)
+            else:
+                count = 0
         
-        # Response only caches data, resolve
-        rr = response.render()
+            # Only record the build if all writes worked
+            self.writer.flush()
+        if (self.stats is not None):
+            self.stats.summary(round(time.perf_counter() - start, 6))
+            self.stats.close()
+        if (self.sync and not(self.partial) and (self.shard is None)):
+            # New files are in place, so orphans can go
+            self.delete_count += self.delete_orphans()
+        if (not(self.filters) and not(self.since)):
+            # A narrowed build skips objects changed before it, so
+            # the next incremental build must still look for them
+            self.manifest.set_build(self.name, started.isoformat())
+        self.save()
+        return count
+
+    def save(self):
+        '''
+        Finish writes, then save the manifest and dependencies.
+        '''
+        self.writer.flush()
+        if (self.shard is None):
+            self.manifest.save()
+        else:
+            self.save_shard()
+        if (self.deps is not None):
+            self.deps.commit()
+
+    def get_shard_manifest(self, shard, count):
+        return Manifest(self.filepath, shard_manifest_name(self.name, shard, count))
+
+    def save_shard(self):
+        '''
+        Save a shard manifest, recording every file produced by the
+        shard, changed or not.
+        Shards write separate files, so do not race on the manifest.
+        '''
+        m = self.get_shard_manifest(*self.shard)
+        m.clear()
+        m.update({name: self.manifest.files[name] for name in self.produced if (name in self.manifest.files)})
+        stamp = self.manifest.get_build(self.name)
+        if (stamp):
+            m.set_build(self.name, stamp)
+        m.partial = self.partial
+        m.save()
+
+    def merge_shards(self, count):
+        '''
+        Combine the manifests of the shards of a build into the 
+        manifest, then delete orphans, once.
+        Orphans are files recorded before, but produced by no shard. If
+        a shard was partial (e.g. incremental), only files of objects
+        no longer in the query are deleted. Shard manifests are deleted
+        after.
+        return
+            count of files deleted
+        '''
+        shards = [self.get_shard_manifest(i, count) for i in range(1, count + 1)]
+        missing = [i + 1 for i, m in enumerate(shards) if not(m.path.is_file())]
+        if (missing):
+            raise FileNotFoundError(f'Shards have not been built. entry:"{self.name}" shards:{missing}')
+        produced = {}
+        for m in shards:
+            produced.update({k: v for k, v in m.files.items() if (v.get('entry') == self.name)})
+        self.manifest.update(produced)
+        self.produced = set(produced)
+        if (any(m.partial for m in shards)):
+            if (self.query):
+                self.delete_count = self.delete_vanished(self.get_queryset(self.view_for(self.View)))
+        else:
+            self.delete_count = self.delete_orphans()
+
+        # The earliest, so the next incremental build misses nothing
+        stamps = [m.get_build(self.name) for m in shards]
+        if (all(stamps)):
+            self.manifest.set_build(self.name, min(stamps))
+        self.save()
+        for m in shards:
+            m.path.unlink()
+        return self.delete_count
         
-        # Gets the data itself
-        #! still bytes
-        #! where stripped?
-        cf = ContentFile(rr.content, name=None)
-        generated_size = cf.size
-        if ((generated_size != size) or self.overwrite):
-            with open(full_filepath, 'wb') as fd:  
-                fd.writelines(cf.open())  
-            return full_filepath
-        return None
+    def create_objects(self, pks):
+        '''
+        Render objects by pk, then save.
+        For updating a few pages outside of a build.
+        return
+            count of files written
+        '''
+        count = self.render_pks(pks)
+        self.save()
+        return count
 
-    def create(self):
+    def update_targets(self, targets):
+        '''
+        Render pages by target, then save.
+        A target is as in the dependency index, a pk for a query, a URL
+        for URLs, ignored for a one-off page. Objects no longer in the
+        query, e.g. unpublished, have their files deleted, counted in
+        delete_count.
+        return
+            count of files written
+        '''
         if (self.urls):
-            return self.render_urls(self.urls)
-        if (self.query):
-            return self.render_query_set(self.View, self.query)
-        return self.render_no_input(self.View, self.filename)
+            count = self.render_urls({k: v for k, v in self.urls.items() if (k in targets)})
+        elif (self.query):
+            targets = set(str(pk) for pk in targets)
+            view = self.view_for(self.View)
+            qs = self.get_queryset(view).filter(pk__in=targets)
+            live = set(str(pk) for pk in qs.values_list('pk', flat=True))
+            gone = targets - live
+            if (gone):
+                self.delete_count += self.delete_recorded(lambda name, r: r.get('pk') in gone)
+            count = self.render_objects(view, qs)
+        else:
+            count = self.render_no_input(self.View, self.filename)
+        self.save()
+        return count
 
+    def delete_objects(self, pks):
+        '''
+        Delete the files of objects by pk, then save.
+        Files are found from the manifest.
+        return
+            count of files deleted
+        '''
+        pks = set(str(pk) for pk in pks)
+        count = self.delete_recorded(lambda name, r: r.get('pk') in pks)
+        self.save()
+        return count
+        
     def delete(self):
         '''
-        Delete existing generated files.
-        Crude, simply clears the target directory. Will not clear the
-        directory itself, nor subdirectories.
+        Delete the files this manager generated, then save.
+        Files are found from the manifest, so files of other managers
+        in the directory, and files put there by hand, are left alone.
+        return
+            count of files deleted
         '''
-        count = 0
-        for path in self.filepath.iterdir():
-            # The app can generate a nested directory structure. IT is
-            # possible a general delete will find a nested directory.
-            # We do not want to delete that, as it may not be requested
-            # by the user. So gently as psssible, exceptions are quietly 
-            # ignored
-            r = None
-            try:
-                r = path.unlink(missing_ok=True)
-            except:
-                pass
-            if (r):
-                count += 1
+        count = self.delete_recorded(lambda name, r: True)
+        if (self.deps is not None):
+            self.deps.clear(self.name)
+        self.save()
         return count
         
         
 
         
-def file_static_merge(obj, view):
+def file_static_merge(obj, view, **kwargs):
     '''
     Preconfigured Filesystem save.
-    PK for id and overwriting.
+    PK for id and overwriting. kwargs are passed to the manager.
+    For a busy site, see static_models.jobqueue, which does not render
+    inside the save.
     '''
-    g = ViewStaticManager(obj._meta.model, view, overwrite=True)
-    g.obj_create(obj)
+    g = ViewStaticManager(view, query='all', overwrite=True, **kwargs)
+    return g.create_objects([obj.pk])
 
-def file_static_delete(obj, view):
+def file_static_delete(obj, view, **kwargs):
     '''
     Preconfigured Filesystem delete.
-    PK for id.
+    PK for id. kwargs are passed to the manager, and should match 
+    those the file was made with e.g. extension.
     '''
-    g = ViewStaticManager(obj._meta.model, view)
-    g.delete(obj)
+    g = ViewStaticManager(view, query='all', **kwargs)
+    count = g.delete_objects([obj.pk])
+    if (count == 0):
+        # Maybe made before the manifest. Try where it would be
+        full_filepath = g.obj_filepath(obj)
+        if (full_filepath.is_file()):
+            g.writer.delete(full_filepath)
+            count = 1
+    return count
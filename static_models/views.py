@@ -1,23 +1,152 @@
+import os
+import re
 import posixpath
 from pathlib import Path
 from django.core.exceptions import ImproperlyConfigured
 from django.views.generic.base import View
 from django.http import (
-    Http404, HttpResponseNotModified,
+    Http404, HttpResponse, StreamingHttpResponse,
 )
 from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.translation import gettext as _, gettext_lazy
 from static_models.response import AssuredFileResponse
-from django.views.static import was_modified_since
-from django.utils.http import http_date
+from static_models.writer import SIDECARS, sidecar_path
+from static_models.layout import check_fanout, fanout_path
+from static_models.pack import get_reader
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+
+OFFLOAD_MODES = (None, 'x-sendfile', 'x-accel-redirect')
+
+range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def accepted_encodings(header):
+    '''
+    Return the set of encodings in an Accept-Encoding header.
+    Encodings with 'q=0' are refused, so not included. 
+    '''
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        q = params.strip()
+        if (q.startswith('q=')):
+            try:
+                if (float(q[2:]) == 0):
+                    continue
+            except ValueError:
+                continue
+        if (token):
+            accepted.add(token)
+    return accepted
+
+def parse_range(header, size):
+    '''
+    Parse a Range header.
+    Only a single range is supported. 
+    return
+        (start, length), None if the header is not usable (so the 
+        whole file should be sent), or False if the range can not be
+        satisfied.
+    '''
+    m = range_re.match(header.strip())
+    if (not(m) or (m[1] == '' and m[2] == '')):
+        return None
+    if (m[1] == ''):
+        # suffix, the last n bytes
+        length = min(int(m[2]), size)
+        if (length == 0):
+            return False
+        return (size - length, length)
+    start = int(m[1])
+    end = size - 1 if (m[2] == '') else min(int(m[2]), size - 1)
+    if ((start >= size) or (end < start)):
+        return False
+    return (start, end - start + 1)
+
+def make_etag(statobj, encoding=None):
+    # Files are replaced on write, not rewritten, so a new file has a
+    # new inode and mtime. That makes this a strong ETag
+    tag = '{:x}-{:x}-{:x}'.format(statobj.st_ino, statobj.st_mtime_ns, statobj.st_size)
+    if (encoding):
+        tag += '-' + encoding
+    return f'"{tag}"'
+
+class FileRange():
+    '''
+    Iterate part of an open file, in blocks. The file is closed when
+    done, or by close(), which a response calls even if the part was
+    never read.
+    '''
+    def __init__(self, f, start, length, block_size=65536):
+        self.f = f
+        self.start = start
+        self.length = length
+        self.block_size = block_size
+
+    def __iter__(self):
+        try:
+            self.f.seek(self.start)
+            length = self.length
+            while (length > 0):
+                data = self.f.read(min(self.block_size, length))
+                if (not(data)):
+                    break
+                length -= len(data)
+                yield data
+        finally:
+            self.close()
+
+    def close(self):
+        self.f.close()
 
 
 
 #! Probably needs a alternate id field slector
 class StaticResponseMixin:
+    '''
+    Deliver a file as response.
+    path_root
+        Path to a directory of files used as response data.
+    use_sidecars
+        If the client accepts an encoding, and a compressed copy of
+        the file exists alongside e.g. 'page.gz', deliver that.
+        Default is True.
+    offload
+        None, 'x-sendfile', or 'x-accel-redirect'. If None, the file 
+        is streamed by Django (which will use the WSGI server's 
+        file_wrapper, so maybe sendfile(), if available). Otherwise an
+        empty response is returned with a header asking the front 
+        server to deliver the file. 
+    offload_prefix
+        For 'x-accel-redirect'. The URL of an internal location, in 
+        the front server, mapped to path_root. 
+    cache
+        Optional static_models.cache.FileCache. If given, file stats 
+        and small files are delivered from memory.
+    fanout
+        None, 'hash' or 'prefix'. As the manager that generated the
+        files. The last part of the id path is looked for in fanout
+        directories e.g. 'article/12345' as 'article/3f/a0/12345'.
+    fanout_depth
+        As the manager. Default is 2.
+    pack
+        Path of a pack file written by the generator. If given, pages
+        are delivered from the pack, not files, and path_root is not
+        needed. The id path is the name in the pack e.g. 
+        'article/12345'. Can not be used with offload.
+    '''
     #NB this is a muddle of DetailView, other base view code, and 
     # impatience with Django twaddle. 
     path_root=None
+    use_sidecars = True
+    offload = None
+    offload_prefix = None
+    cache = None
+    fanout = None
+    fanout_depth = 2
+    pack = None
 
     def __init__(self, **kwargs):   
         kwargs['content_type'] ='text/html' 
@@ -25,10 +154,21 @@ class StaticResponseMixin:
 
         #NB TemplateResponseMixin uses late call to check path_root not None.
         # Flexible, but weedy. Define by init, or error.
-        if self.path_root is None:
+        if (self.path_root is None) and (self.pack is None):
             raise ImproperlyConfigured(
                 "StaticView requires an attribute 'path_root'"
                 " which can be defined, or passed in initial parameters")
+        if self.offload not in OFFLOAD_MODES:
+            raise ImproperlyConfigured(
+                f"StaticView attribute 'offload' must be one of {OFFLOAD_MODES}")
+        if (self.offload == 'x-accel-redirect') and (self.offload_prefix is None):
+            raise ImproperlyConfigured(
+                "StaticView with offload 'x-accel-redirect' requires an"
+                " attribute 'offload_prefix'")
+        if (self.offload and self.pack):
+            raise ImproperlyConfigured(
+                "StaticView can not offload pages in a pack")
+        check_fanout(self.fanout, self.fanout_depth)
 
     def get_id_path(self):
         id_path=None
@@ -56,37 +196,249 @@ class StaticResponseMixin:
             )            
         return id_path #+ '.html'
 
+    def get_rel_path(self):
+        # The id path, in any fanout directories. Never a dotfile, such
+        # as a manifest or a temporary file
+        id_path = self.get_id_path()
+        if (any(part.startswith('.') for part in id_path.split('/'))):
+            raise Http404(_('“%(path)s” does not exist') % {'path': id_path})
+        if (self.fanout):
+            head, sep, name = id_path.rpartition('/')
+            id_path = posixpath.join(head, fanout_path(name, self.fanout, self.fanout_depth))
+        return id_path
+
     def get_fullpath(self):
         #NB split out so you could, say, implement a 'delete' method on 
         # a view
-        return Path(safe_join(self.path_root + self.get_id_path()))
-    
+        return Path(safe_join(self.path_root + self.get_rel_path()))
+
+    def get_pack_name(self):
+        # As get_fullpath(), for a pack. Never outside the root
+        name = posixpath.normpath(self.get_rel_path())
+        if ((name == '..') or name.startswith('../') or name.startswith('/')):
+            raise Http404(_('“%(path)s” does not exist') % {'path': name})
+        return name
+
+    def lookup(self, path):
+        '''
+        return
+            (stat, body, file). If the body is cached, file is None.
+            Otherwise the file is opened, and the stat is of the open
+            file. The generator replaces files by rename, so a stat of
+            the path could be of another file than the one sent. With
+            offload, the file is not opened, as the front server sends
+            it.
+        '''
+        if (self.cache is not None):
+            entry = self.cache.get(path)
+            if ((entry.body is not None) or self.offload):
+                return (entry.stat, entry.body, None)
+        if (self.offload):
+            return (path.stat(), None, None)
+        f = path.open('rb')
+        return (os.fstat(f.fileno()), None, f)
+        
+    def negotiate(self, fullpath):
+        '''
+        Choose the file to deliver.
+        return
+            (path, stat, body, file, encoding). As lookup(). encoding
+            is None for the file itself.
+        '''
+        if (self.use_sidecars):
+            accepted = accepted_encodings(self.request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding in SIDECARS:
+                if (encoding in accepted):
+                    path = sidecar_path(fullpath, encoding)
+                    try:
+                        return (path, *self.lookup(path), encoding)
+                    except FileNotFoundError:
+                        pass
+        return (fullpath, *self.lookup(fullpath), None)
+
+    def negotiate_pack(self, reader, name):
+        '''
+        As negotiate(), for a page in a pack.
+        Raises FileNotFoundError if the page is not in the pack.
+        return
+            (entry, data, encoding). data is a memoryview of the pack.
+        '''
+        if (self.use_sidecars):
+            accepted = accepted_encodings(self.request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding, suffix in SIDECARS.items():
+                if (encoding in accepted):
+                    found = reader.get(name + suffix)
+                    if (found is not None):
+                        return (*found, encoding)
+        found = reader.get(name)
+        if (found is None):
+            raise FileNotFoundError(name)
+        return (*found, None)
+
+    def set_common_headers(self, response, statobj, etag, encoding):
+        response['Last-Modified'] = http_date(statobj.st_mtime)
+        response['ETag'] = etag
+        if (encoding):
+            response['Content-Encoding'] = encoding
+        if (self.use_sidecars):
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def get_range(self, etag, statobj):
+        '''
+        Return a range to deliver, from the Range header.
+        return
+            as parse_range(). Also None if If-Range does not match the
+            file.
+        '''
+        header = self.request.META.get('HTTP_RANGE')
+        if (not(header)):
+            return None
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if (if_range):
+            if (if_range.startswith('"') or if_range.startswith('W/')):
+                if (parse_etags(if_range) != [etag]):
+                    return None
+            elif (parse_http_date_safe(if_range) != int(statobj.st_mtime)):
+                return None
+        return parse_range(header, statobj.st_size)
+
+    def offload_response(self, path, content_type):
+        response = HttpResponse(content_type=content_type)
+        if (self.offload == 'x-sendfile'):
+            response['X-Sendfile'] = str(path)
+        else:
+            relpath = path.relative_to(Path(self.path_root)).as_posix()
+            response['X-Accel-Redirect'] = self.offload_prefix.rstrip('/') + '/' + relpath
+        return response
+        
+    def pack_response(self, **response_kwargs):
+        '''
+        As render_to_response(), for a page in a pack.
+        The page is sliced from the memory-mapped pack. The response
+        copies the slice once, into its content.
+        '''
+        name = self.get_pack_name()
+        try:
+            entry, data, encoding = self.negotiate_pack(get_reader(self.pack), name)
+        except FileNotFoundError:
+            raise Http404(_('“%(path)s” does not exist') % {'path': name})
+        content_type = response_kwargs.pop('content_type', self.content_type)
+
+        # A hash of the content, so strong, and the same after a 
+        # compaction, or a copy to another server
+        etag = f'"{entry.hash}"'
+        response = get_conditional_response(
+            self.request, 
+            etag=etag, 
+            last_modified=int(entry.st_mtime)
+        )
+        if (response is not None):
+            return self.set_common_headers(response, entry, etag, encoding)
+
+        byte_range = self.get_range(etag, entry)
+        if (byte_range is False):
+            response = HttpResponse(status=416, content_type=content_type)
+            response['Content-Range'] = f'bytes */{entry.st_size}'
+            return response
+        if (byte_range):
+            start, length = byte_range
+            response = HttpResponse(
+                data[start:start + length], 
+                status=206, 
+                content_type=content_type, 
+                **response_kwargs
+            )
+            response['Content-Range'] = f'bytes {start}-{start + length - 1}/{entry.st_size}'
+        else:
+            response = HttpResponse(data, content_type=content_type, **response_kwargs)
+        response['Content-Length'] = str(len(response.content))
+        response['Accept-Ranges'] = 'bytes'
+        return self.set_common_headers(response, entry, etag, encoding)
+
     def render_to_response(self, **response_kwargs):
         '''
         Use class data to make a Django HTTP response.
         Would only in most universes be implemented on 'get'
         '''
+        if (self.pack):
+            return self.pack_response(**response_kwargs)
+
         #NB some code here comes from django.views.static
         fullpath = self.get_fullpath()
-        
-        # Respect the If-Modified-Since header.
-        statobj = fullpath.stat()
-        if not was_modified_since(self.request.META.get('HTTP_IF_MODIFIED_SINCE'),
-                                  statobj.st_mtime, statobj.st_size):
-            return HttpResponseNotModified()
         try:
-            f = fullpath.open('rb')
+            path, statobj, body, f, encoding = self.negotiate(fullpath)
         except FileNotFoundError:
             raise Http404(_('“%(path)s” does not exist') % {'path': fullpath})
+        try:
+            return self.file_response(fullpath, path, statobj, body, f, encoding, **response_kwargs)
+        except BaseException:
+            if (f is not None):
+                f.close()
+            raise
+
+    def file_response(self, fullpath, path, statobj, body, f, encoding, **response_kwargs):
+        # The response for a negotiated file. Headers are from statobj,
+        # the content from the body, or f. f is closed if not sent
+        content_type = response_kwargs.pop('content_type', self.content_type)
+        etag = make_etag(statobj, encoding)
 
-        response = AssuredFileResponse(
-            f,
-            as_attachment=False,
-            content_type='text/html',
-            **response_kwargs
+        # Respect If-None-Match, If-Modified-Since, and friends
+        response = get_conditional_response(
+            self.request, 
+            etag=etag, 
+            last_modified=int(statobj.st_mtime)
         )
-        response["Last-Modified"] = http_date(statobj.st_mtime)
-        return response
+        if (response is not None):
+            if (f is not None):
+                f.close()
+            return self.set_common_headers(response, statobj, etag, encoding)
+
+        if (self.offload):
+            response = self.offload_response(path, content_type)
+            return self.set_common_headers(response, statobj, etag, encoding)
+            
+        byte_range = self.get_range(etag, statobj)
+        if (byte_range is False):
+            if (f is not None):
+                f.close()
+            response = HttpResponse(status=416, content_type=content_type)
+            response['Content-Range'] = f'bytes */{statobj.st_size}'
+            return response
+        if (byte_range and (f is None)):
+            # Cached. The range is sliced from the body
+            start, length = byte_range
+            response = HttpResponse(
+                body[start:start + length],
+                status=206,
+                content_type=content_type,
+                **response_kwargs
+            )
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{start + length - 1}/{statobj.st_size}'
+        elif (byte_range):
+            start, length = byte_range
+            response = StreamingHttpResponse(
+                FileRange(f, start, length), 
+                status=206,
+                content_type=content_type,
+                **response_kwargs
+            )
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{start + length - 1}/{statobj.st_size}'
+        elif (body is not None):
+            response = HttpResponse(body, content_type=content_type, **response_kwargs)
+        else:
+            response = AssuredFileResponse(
+                f,
+                as_attachment=False,
+                filename=fullpath.name,
+                content_type=content_type,
+                content_length=statobj.st_size,
+                **response_kwargs
+            )
+        response['Accept-Ranges'] = 'bytes'
+        return self.set_common_headers(response, statobj, etag, encoding)
             
             
             
@@ -0,0 +1,366 @@
+import os
+import gzip
+import zlib
+import errno
+import secrets
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.core.exceptions import ImproperlyConfigured
+from static_models.manifest import new_hash, file_hash
+from static_models.signals import page_written
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FSYNC_POLICIES = ('none', 'file', 'batch')
+
+# Content-Encoding -> extension of the compressed file, written 
+# alongside the original. In order of preference when serving.
+SIDECARS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+def gzip_compress(content):
+    # mtime=0, so the same content gives the same file
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+def brotli_compress(content):
+    return brotli.compress(content, mode=brotli.MODE_TEXT)
+
+COMPRESSORS = {
+    'br': brotli_compress,
+    'gzip': gzip_compress,
+}
+
+def gzip_compressor():
+    # As gzip_compress(), in parts. wbits=31 is a gzip wrapper, with
+    # mtime 0
+    return zlib.compressobj(9, zlib.DEFLATED, 31)
+
+class BrotliCompressor():
+    # As brotli_compress(), in parts. With the interface of a zlib 
+    # compressobj
+    def __init__(self):
+        self.c = brotli.Compressor(mode=brotli.MODE_TEXT)
+
+    def compress(self, data):
+        return self.c.process(data)
+
+    def flush(self):
+        return self.c.finish()
+
+STREAM_COMPRESSORS = {
+    'br': BrotliCompressor,
+    'gzip': gzip_compressor,
+}
+
+def sidecar_path(path, encoding):
+    return path.with_name(path.name + SIDECARS[encoding])
+
+# Flags for temporary files, as tempfile.mkstemp()
+TEMP_FLAGS = (os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0))
+
+def mkstemp(dirpath, prefix, suffix='.tmp'):
+    '''
+    Make a temporary file, as tempfile.mkstemp(). But mkstemp() makes
+    files only the owner can read, and generated files are for 
+    serving. So the file is given the permissions open() would give,
+    by the umask.
+    return
+        (fd, temporary path)
+    '''
+    for _ in range(tempfile.TMP_MAX):
+        tmp = os.path.join(dirpath, prefix + secrets.token_hex(6) + suffix)
+        try:
+            return (os.open(tmp, TEMP_FLAGS, 0o666), tmp)
+        except FileExistsError:
+            continue
+    raise FileExistsError(errno.EEXIST, 'No unused temporary file name', str(dirpath))
+
+def mkstemp_beside(path):
+    '''
+    Make a temporary file in the directory of path, so it can be 
+    renamed over path. Makes the directory if missing e.g. a new 
+    fanout directory.
+    return
+        (fd, temporary path), as mkstemp()
+    '''
+    try:
+        return mkstemp(path.parent, '.' + path.name)
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return mkstemp(path.parent, '.' + path.name)
+
+def check_options(fsync, compress):
+    if (fsync not in FSYNC_POLICIES):
+        raise ImproperlyConfigured(f'Unknown fsync policy. Must be one of {FSYNC_POLICIES}. value:"{fsync}"')
+    for encoding in compress:
+        if (encoding not in COMPRESSORS):
+            raise ImproperlyConfigured(f'Unknown compression. Must be one of {tuple(COMPRESSORS)}. value:"{encoding}"')
+    if (('br' in compress) and (brotli is None)):
+        raise ImproperlyConfigured('Compression "br" requires the "brotli" package')
+
+def fsync_dir(dirpath):
+    # Make renames in the directory durable
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+
+class StagedFile():
+    '''
+    Content for a file, written in chunks to a temporary file beside
+    it. Hashed as it is written, so the content need never be held 
+    whole. Made by FileWriter.stage(), then given to commit(), or 
+    discarded.
+    path
+        Path of the file the content is for.
+    fsync
+        fsync the temporary file on close.
+    dirpath
+        Directory for the temporary file, if not beside the path.
+    '''
+    def __init__(self, path, fsync=False, dirpath=None):
+        self.path = path
+        if (dirpath is None):
+            fd, self.tmp = mkstemp_beside(path)
+        else:
+            fd, self.tmp = mkstemp(dirpath, '.' + path.name)
+        self.fd = os.fdopen(fd, 'wb')
+        self.fsync = fsync
+        self.hash = new_hash()
+        self.size = 0
+        self.digest = None
+
+    def write(self, chunk):
+        self.fd.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        '''
+        Finish writing.
+        return
+            hash of the content, as manifest.content_hash()
+        '''
+        if (self.fsync):
+            self.fd.flush()
+            os.fsync(self.fd.fileno())
+        self.fd.close()
+        self.digest = self.hash.hexdigest()
+        return self.digest
+
+    def discard(self):
+        if (not(self.fd.closed)):
+            self.fd.close()
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+
+
+
+class FileWriter():
+    '''
+    Write generated files.
+    Content is written to a temporary file in the same directory, then
+    renamed over the target. So a server reading the target sees the
+    old file or the new, never part of a file.
+    fsync
+        'none' leaves flushing to the OS. 'file' fsyncs each file and
+        its directory as it is written. 'batch' fsyncs files and
+        directories on flush(), each directory once. Default is 'none'.
+    threads
+        If more than 0, writes are made by a pool of threads, and
+        write() returns at once. Errors are raised on flush(). Default
+        is 0, write in the calling thread.
+    compress
+        List of encodings, 'gzip' and/or 'br'. For each, a compressed
+        copy of the file is written alongside e.g. 'page.gz', so a 
+        server can deliver without compressing on the fly. 'br' needs
+        the 'brotli' package.
+    '''
+    # Where pages are written, recorded in the manifest. None for files
+    target = None
+
+    def __init__(self, fsync='none', threads=0, compress=()):
+        check_options(fsync, compress)
+        self.fsync = fsync
+        self.compress = tuple(compress)
+        self.threads = threads
+        self.pool = None
+
+        # Writes in flight, and writes which failed, in order. Writes
+        # which worked are dropped, so a long build holds none
+        self.futures = {}
+
+        # Limit writes held in memory, waiting for a thread
+        self.pending = threading.BoundedSemaphore(max(1, threads * 4))
+
+        # For 'batch', paths written since the last flush
+        self.written = []
+        self.lock = threading.Lock()
+
+    def write(self, content, path):
+        '''
+        Write bytes to a path.
+        '''
+        self._submit(self._write, content, path)
+
+    def stage(self, path):
+        '''
+        Start content for a path, to be written in chunks.
+        return
+            a StagedFile
+        '''
+        return StagedFile(path, fsync=(self.fsync == 'file'))
+
+    def commit(self, staged):
+        '''
+        Put a closed StagedFile in place, with compressed copies.
+        '''
+        self._submit(self._commit, staged)
+
+    def _submit(self, fn, *args):
+        if (not(self.threads)):
+            fn(*args)
+            return
+        if (self.pool is None):
+            self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending.acquire()
+        try:
+            future = self.pool.submit(fn, *args)
+        except BaseException:
+            self.pending.release()
+            raise
+        with self.lock:
+            self.futures[future] = None
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        if (not(future.cancelled()) and (future.exception() is None)):
+            with self.lock:
+                self.futures.pop(future, None)
+        self.pending.release()
+
+    def _write(self, content, path):
+        # Compressed files first. Then, if a server looks for them 
+        # after finding the file, they are at least as new.
+        for encoding in SIDECARS:
+            if (encoding in self.compress):
+                self._replace(COMPRESSORS[encoding](content), sidecar_path(path, encoding))
+            else:
+                # A stale copy would be served in place of the new file
+                sidecar_path(path, encoding).unlink(missing_ok=True)
+        self._replace(content, path)
+        page_written.send(sender=self.__class__, path=path)
+        
+    def _commit(self, staged):
+        # As _write(), but the content is in a file, so is compressed
+        # from the file, in chunks
+        path = staged.path
+        try:
+            for encoding in SIDECARS:
+                if (encoding in self.compress):
+                    self._compress_file(staged.tmp, sidecar_path(path, encoding), encoding)
+                else:
+                    sidecar_path(path, encoding).unlink(missing_ok=True)
+            self._place(staged.tmp, path)
+        except BaseException:
+            staged.discard()
+            raise
+        page_written.send(sender=self.__class__, path=path)
+
+    def _compress_file(self, src, path, encoding, chunk_size=65536):
+        c = STREAM_COMPRESSORS[encoding]()
+        staged = self.stage(path)
+        try:
+            with open(src, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(chunk_size), b''):
+                    staged.write(c.compress(chunk))
+            staged.write(c.flush())
+            staged.close()
+            self._place(staged.tmp, path)
+        except BaseException:
+            staged.discard()
+            raise
+
+    def _replace(self, content, path):
+        fd, tmp = mkstemp_beside(path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                if (self.fsync == 'file'):
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._place(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _place(self, tmp, path):
+        # Rename a complete temporary file over the path
+        os.replace(tmp, path)
+        if (self.fsync == 'file'):
+            fsync_dir(path.parent)
+        elif (self.fsync == 'batch'):
+            with self.lock:
+                self.written.append(path)
+
+    def stored_hash(self, path):
+        '''
+        Hash of the file at a path, or None if missing.
+        '''
+        if (not(path.is_file())):
+            return None
+        return file_hash(path)
+
+    def delete(self, path):
+        '''
+        Delete a file, and any compressed files alongside.
+        '''
+        path.unlink(missing_ok=True)
+        for encoding in SIDECARS:
+            sidecar_path(path, encoding).unlink(missing_ok=True)
+        page_written.send(sender=self.__class__, path=path)
+        
+    def flush(self):
+        '''
+        Wait for writes to finish, and make batched fsyncs.
+        Raises the first error from a write thread, if any.
+        '''
+        with self.lock:
+            futures, self.futures = self.futures, {}
+        for f in futures:
+            f.result()
+        with self.lock:
+            written, self.written = self.written, []
+        dirs = set()
+        for path in written:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            dirs.add(path.parent)
+        for d in dirs:
+            fsync_dir(d)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if (self.pool is not None):
+                self.pool.shutdown()
+                self.pool = None